@@ -0,0 +1,148 @@
+from __future__ import print_function
+import os.path
+import glob
+import json
+import platform
+import time
+import tracemalloc
+import argparse
+import cv2
+import numpy as np
+
+import convert
+
+
+bundled_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1')
+synthetic_sizes = [256, 1024, 2048]
+
+
+def synthetic_image(size):
+    """Horizontal ramp with a ripple on top, so every algorithm sees every
+    gray level and some texture."""
+    y, x = np.mgrid[:size, :size]
+    ramp = 255.0 * x / max(size - 1, 1)
+    ripple = 40.0 * np.sin(x / 7.0) * np.cos(y / 11.0)
+    return np.clip(ramp + ripple, 0, 255).astype(np.uint8)
+
+
+def image_ladder(sizes, bundled=True):
+    """Yield (name, grayscale image) from the smallest image up."""
+    images = [('synthetic_{}'.format(size), lambda size=size: synthetic_image(size))
+              for size in sizes]
+    if bundled:
+        for path in sorted(glob.glob(os.path.join(bundled_dir, 'exercise*', '*_*.*'))):
+            if os.path.splitext(path)[1].lower() in ('.png', '.jpg', '.jpeg'):
+                images.append((os.path.relpath(path, bundled_dir),
+                               lambda path=path: convert.load_gray(path)))
+
+    loaded = [(name, load()) for name, load in images]
+    loaded.sort(key=lambda item: item[1].size)
+    return loaded
+
+
+def measure(alg, src, options, repeat):
+    """Best wall time of repeat runs, then the peak of memory traced during
+    one more run (tracing slows Python code down, so it is not timed)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert.algoritms[alg](src, **options)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        convert.algoritms[alg](src, **options)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmark(algs, sizes, bundled, repeat, workers):
+    results = []
+    for name, src in image_ladder(sizes, bundled):
+        for alg in algs:
+            options = {}
+            if workers > 1 and alg in convert.diffusion_algoritms:
+                options['workers'] = workers
+            seconds, peak = measure(alg, src, options, repeat)
+            result = {'image': name,
+                      'shape': list(src.shape),
+                      'alg': alg,
+                      'seconds': seconds,
+                      'mpix_per_s': src.size / 1e6 / seconds if seconds else float('inf'),
+                      'peak_mb': peak / 2.0 ** 20}
+            print('{:<32} {:<12} {:>9.3f}s {:>9.2f} MP/s {:>9.1f} MB'.format(
+                name, alg, seconds, result['mpix_per_s'], result['peak_mb']))
+            results.append(result)
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cv2': cv2.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance):
+    """Print the speed change of every result found in baseline and return
+    the ones that got slower than tolerance allows."""
+    reference = dict(((r['image'], r['alg']), r) for r in baseline['results'])
+    slower = []
+    for r in results:
+        base = reference.get((r['image'], r['alg']))
+        if base is None:
+            continue
+        ratio = r['mpix_per_s'] / base['mpix_per_s']
+        flag = ''
+        if ratio < 1 - tolerance:
+            flag = '  SLOWER'
+            slower.append(r)
+        print('{:<32} {:<12} {:>9.2f} -> {:>9.2f} MP/s ({:+.0%}){}'.format(
+            r['image'], r['alg'], base['mpix_per_s'], r['mpix_per_s'], ratio - 1, flag))
+    return slower
+
+
+def parse_args():
+    m = argparse.ArgumentParser(description="Benchmark the convert.py algorithms")
+    m.add_argument("--alg", "-a", type=str, nargs='+', choices=list(convert.algoritms),
+                   default=list(convert.algoritms), help="Algorithms to run, all by default")
+    m.add_argument("--sizes", type=int, nargs='*', default=synthetic_sizes,
+                   help="Sides of the synthetic square images")
+    m.add_argument("--no-bundled", action='store_true',
+                   help="Skip the images bundled in ../1")
+    m.add_argument("--repeat", type=int, default=3,
+                   help="Timed runs per image, the best one is reported")
+    m.add_argument("--workers", "-w", type=int, default=1,
+                   help="Processes for error diffusion algorithms")
+    m.add_argument("--output", "-o", type=str, default=None,
+                   help="Write results as JSON")
+    m.add_argument("--compare", type=str, default=None,
+                   help="Baseline JSON to compare against")
+    m.add_argument("--tolerance", type=float, default=0.1,
+                   help="Slowdown against the baseline that is still accepted")
+    return m.parse_args()
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    results = run_benchmark(args.alg, args.sizes, not args.no_bundled, args.repeat, args.workers)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, args.tolerance)
+        if slower:
+            print('{} results slower than the baseline'.format(len(slower)))
+            exit(1)
+
+    exit(0)
@@ -0,0 +1,179 @@
+import os.path
+import struct
+import zlib
+import numpy as np
+
+import pnm
+
+
+# bit-packed images hold 8 pixels per byte along each row, 1 is black as
+# in PBM, the last byte of a row is padded with zero bits
+
+def pack(dst):
+    """Pack a 0/255 image (or a strip of it) into bits."""
+    return np.packbits(dst < 128, axis=1)
+
+
+def unpack(bits, width):
+    """Expand bits back into a 0/255 uint8 image of the given width."""
+    return 255 * (1 - np.unpackbits(bits, axis=1, count=width))
+
+
+class PngWriter(object):
+    """Write a 1-bit grayscale PNG strip by strip."""
+    packed = True
+
+    def __init__(self, path, width, height, level=6, dpi=None):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.z = zlib.compressobj(level)
+        self.f = open(path, 'wb')
+        self.f.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0))
+        if dpi:
+            # pixels per meter
+            ppm = int(round(dpi / 0.0254))
+            self._chunk(b'pHYs', struct.pack('>IIB', ppm, ppm, 1))
+
+    def _chunk(self, tag, data):
+        self.f.write(struct.pack('>I', len(data)) + tag + data)
+        self.f.write(struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    def write(self, bits):
+        # PNG stores white as 1, every row starts with filter type 0
+        rows = np.empty((bits.shape[0], bits.shape[1] + 1), dtype=np.uint8)
+        rows[:, 0] = 0
+        np.invert(bits, out=rows[:, 1:])
+        data = self.z.compress(rows.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows += bits.shape[0]
+
+    def close(self):
+        self._chunk(b'IDAT', self.z.flush())
+        self._chunk(b'IEND', b'')
+        self.f.close()
+        if self.rows != self.height:
+            raise RuntimeError('PNG: wrote {} of {} rows'.format(self.rows, self.height))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+class TiffWriter(object):
+    """Write a deflate-compressed bilevel TIFF strip by strip."""
+    packed = True
+
+    def __init__(self, path, width, height, level=6, rows_per_strip=64, dpi=72):
+        self.width = width
+        self.height = height
+        self.level = level
+        self.rows_per_strip = rows_per_strip
+        self.dpi = dpi
+        self.rows = 0
+        self.pending = []
+        self.offsets = []
+        self.counts = []
+        self.f = open(path, 'wb')
+        # little-endian header, the IFD offset is patched in on close
+        self.f.write(b'II*\x00\x00\x00\x00\x00')
+
+    def _flush(self, final=False):
+        bits = np.concatenate(self.pending) if self.pending else np.zeros((0, 0), np.uint8)
+        done = 0
+        while bits.shape[0] - done >= self.rows_per_strip or (final and done < bits.shape[0]):
+            strip = bits[done:done + self.rows_per_strip]
+            data = zlib.compress(strip.tobytes(), self.level)
+            self.offsets.append(self.f.tell())
+            self.counts.append(len(data))
+            self.f.write(data)
+            done += strip.shape[0]
+        self.pending = [bits[done:]]
+
+    def write(self, bits):
+        self.pending.append(bits)
+        self.rows += bits.shape[0]
+        if sum(p.shape[0] for p in self.pending) >= self.rows_per_strip:
+            self._flush()
+
+    def close(self):
+        self._flush(final=True)
+        if self.f.tell() % 2:
+            self.f.write(b'\x00')
+
+        entries = [(256, 4, [self.width]),                  # ImageWidth
+                   (257, 4, [self.height]),                 # ImageLength
+                   (258, 3, [1]),                           # BitsPerSample
+                   (259, 3, [8]),                           # Compression: deflate
+                   (262, 3, [0]),                           # Photometric: WhiteIsZero
+                   (273, 4, self.offsets),                  # StripOffsets
+                   (277, 3, [1]),                           # SamplesPerPixel
+                   (278, 4, [self.rows_per_strip]),         # RowsPerStrip
+                   (279, 4, self.counts),                   # StripByteCounts
+                   (282, 5, [self.dpi, 1]),                 # XResolution
+                   (283, 5, [self.dpi, 1]),                 # YResolution
+                   (296, 3, [2])]                           # ResolutionUnit: inch
+
+        ifd_offset = self.f.tell()
+        data_offset = ifd_offset + 2 + 12 * len(entries) + 4
+        ifd = [struct.pack('<H', len(entries))]
+        extra = []
+        for tag, kind, values in entries:
+            fmt = '<{}{}'.format(len(values), 'H' if kind == 3 else 'I')
+            value = struct.pack(fmt, *values)
+            count = len(values) // 2 if kind == 5 else len(values)
+            if len(value) <= 4:
+                ifd.append(struct.pack('<HHI', tag, kind, count) + value.ljust(4, b'\x00'))
+            else:
+                ifd.append(struct.pack('<HHII', tag, kind, count, data_offset))
+                extra.append(value)
+                data_offset += len(value)
+        ifd.append(struct.pack('<I', 0))
+
+        self.f.write(b''.join(ifd + extra))
+        self.f.seek(4)
+        self.f.write(struct.pack('<I', ifd_offset))
+        self.f.close()
+        if self.rows != self.height:
+            raise RuntimeError('TIFF: wrote {} of {} rows'.format(self.rows, self.height))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+writers = {'.pgm': pnm.PgmWriter,
+           '.pbm': pnm.PbmWriter,
+           '.png': PngWriter,
+           '.tif': TiffWriter,
+           '.tiff': TiffWriter}
+
+
+def open_writer(path, width, height, binary=True, level=None, dpi=None, color=False):
+    """Open a strip writer for path, or return None for formats that are
+    left to cv2.imwrite; 1-bit formats are only used for binary images and
+    none of the writers takes color (3-channel) images.
+    level is the zlib level and dpi the resolution of PNG and TIFF."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in writers or color or (writers[ext].packed and not binary):
+        return None
+    if writers[ext] not in (PngWriter, TiffWriter):
+        return writers[ext](path, width, height)
+    extra = {}
+    if level is not None:
+        extra['level'] = level
+    if dpi:
+        extra['dpi'] = dpi
+    return writers[ext](path, width, height, **extra)
@@ -1,199 +1,543 @@
 from __future__ import print_function
 from sys import argv
 import os.path
+import glob
+import time
+import multiprocessing
+import concurrent.futures
+from functools import partial
 import cv2
 import numpy as np
 import argparse
 
+import bitmap
+import diffusion
+import images
+import pnm
+import profiling
+import quantize
+import thresholds
 
-def round_to_nearest_dithering2(src_path, dst_path, threshold=128):
 
-    src = cv2.imread(src_path)
-    assert src is not None
+def load_gray(src_path):
+    return images.read(src_path)
 
-    if len(src.shape) > 2:
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    y_size, x_size = src.shape
-    dst = np.zeros(src.shape, dtype=np.uint8)
 
-    for y in range(y_size):
-        for x in range(x_size):
-            dst[y, x] = 255 if src[y, x] > threshold else 0
+def load_color(src_path):
+    return images.read(src_path, color=True)
 
-    cv2.imwrite(dst_path, dst)
-    return
 
+# every algorithm takes a palette (see quantize.py) to quantize to instead
+# of black and white; a color palette takes a BGR src
 
-def round_random_dithering2(src_path, dst_path):
-    src = cv2.imread(src_path)
-    assert src is not None
 
-    if len(src.shape) > 2:
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    y_size, x_size = src.shape
-    dst = src
+def round_to_nearest_dithering2(src, threshold=128, palette=None):
+    if palette is not None:
+        return quantize.threshold(src, palette)
+    return 255 * (src > threshold).astype(np.uint8)
 
-    for y in range(y_size):
-        for x in range(x_size):
-            threshold = np.random.randint(0, 256, dtype=np.uint8)
-            dst[y, x] = 255 if src[y, x] > threshold else 0
 
-    cv2.imwrite(dst_path, dst)
+def round_random_dithering2(src, noise=None, palette=None, seed=None, y0=0):
+    """Threshold against random noise drawn from seed (a fresh one if it is
+    None), see thresholds.random_plane; y0 is the row of src within the
+    whole image. noise is a uint8 threshold plane of src's shape to reuse
+    instead of drawing a new one."""
+    if noise is None:
+        if seed is None:
+            seed = thresholds.new_seed()
+        noise = thresholds.random_plane(src.shape[:2], seed, y0)
+    if palette is not None:
+        return quantize.dither(src, palette, noise)
+    return 255 * (src > noise).astype(np.uint8)
 
 
 def get_dithering_matrix(sz):
-    if sz == 2:
-        return np.matrix([[0, 2], [3, 1]], dtype=np.uint8)
-    elif sz == 3:
-        return np.matrix([[0, 7, 3], [6, 5, 2], [4, 1, 8]], dtype=np.uint8)
-    else:
-        m_rec = 4 * get_dithering_matrix(sz//2)
-        m_unit = np.ones([sz//2, sz//2], dtype=np.uint8)
-        m_res = np.vstack([np.hstack([m_rec, m_rec + 2*m_unit]),
-                          np.hstack([m_rec + 3*m_unit, m_rec + m_unit])])
-        return m_res
-
-
-def round_ordered_dithering2(src_path, dst_path, dith_size=16):
-    src = cv2.imread(src_path)
-    assert src is not None
-
-    if len(src.shape) > 2:
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    y_size, x_size = src.shape
-    dst = np.zeros(src.shape, dtype=np.uint8)
-    dith_mat = get_dithering_matrix(dith_size)
-
-    coef = dith_size * dith_size / 255
-    for y in range(y_size):
-        d_y = y % dith_size
-        for x in range(x_size):
-            d_x = x % dith_size
-            dst[y, x] = 255 if coef * src[y, x] > dith_mat[d_y, d_x] else 0
-
-    cv2.imwrite(dst_path, dst)
-    return
+    return thresholds.bayer(sz)
 
 
-def round_error_diff_fwd(src_path, dst_path):
-    src = cv2.imread(src_path)
-    assert src is not None
+def round_ordered_dithering2(src, dith_size=16, y0=0, dith_map='bayer', palette=None):
+    """y0 is the row of src within the whole image, for strips of it;
+    dith_map is a threshold map kind or a matrix file, see thresholds.py."""
+    m = thresholds.tile(thresholds.threshold_map(dith_map, dith_size), src.shape[:2], y0)
+    if palette is not None:
+        return quantize.dither(src, palette, m)
+    return 255 * (src > m).astype(np.uint8)
 
-    if len(src.shape) > 2:
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    y_size, x_size = src.shape
-    dst = np.zeros(src.shape)
 
-    for y in range(y_size):
-        error = 0
-        for x in range(x_size):
-            if int(src[y, x]) + error > 128:
-                error = (int(src[y, x]) + error) - 255
-                dst[y, x] = 255
-            else:
-                error = int(src[y, x]) + error
-                dst[y, x] = 0
+def round_blue_noise_dithering(src, dith_size=64, y0=0, palette=None):
+    """Threshold against a void-and-cluster blue-noise mask, built once and
+    then loaded from the threshold map cache."""
+    return round_ordered_dithering2(src, dith_size, y0, 'blue-noise', palette)
 
-    cv2.imwrite(dst_path, dst)
-    return
 
+def round_error_diffusion(src, kernel='floyd-steinberg', scan='raster', workers=1, palette=None):
+    return diffusion.diffuse(src, kernel, scan, workers=workers, palette=palette)
 
-def round_error_diff_fwd_bwd(src_path, dst_path):
-    src = cv2.imread(src_path)
-    assert src is not None
 
-    if len(src.shape) > 2:
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    y_size, x_size = src.shape
-    dst = np.zeros(src.shape)
+def round_error_diff_fwd(src, scan='raster', workers=1, palette=None):
+    return round_error_diffusion(src, 'carry', scan, workers, palette)
 
-    for y in range(y_size):
-        error = 0
-        c_range = range(x_size - 1, -1, -1) if y % 2 else range(x_size)
-        for x in c_range:
-            if int(src[y, x]) + error > 128:
-                error = (int(src[y, x]) + error) - 255
-                dst[y, x] = 255
-            else:
-                error = int(src[y, x]) + error
-                dst[y, x] = 0
 
-    cv2.imwrite(dst_path, dst)
-    return
-
-
-def round_error_diff_floyd_steinberg(src_path, dst_path):
-    src = cv2.imread(src_path)
-    assert src is not None
+def round_error_diff_fwd_bwd(src, scan='serpentine', workers=1, palette=None):
+    return round_error_diffusion(src, 'carry', scan, workers, palette)
 
-    if len(src.shape) > 2:
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    y_size, x_size = src.shape
-    src = src.astype(int)
-    dst = np.zeros(src.shape)
 
-    error = 0
-    for y in range(y_size):
-        is_even = 1 - 2 * (y % 2)
-        c_range = range(x_size-1, -1, -1) if is_even else range(x_size)
-
-        for x in c_range:
-            if src[y, x] > 128:
-                error = src[y, x] - 255
-                dst[y, x] = 255
-            else:
-                error = src[y, x]
-                dst[y, x] = 0
-
-            if y < y_size-1:
-                src[y+1, x] += (5*error) >> 4
-                if 0 <= x+is_even < x_size:
-                    src[y+1, x+is_even] += error >> 4
-                    src[y, x+is_even] += (7*error) >> 4
-                if 0 <= x-is_even < x_size:
-                    src[y+1, x-is_even] += (3*error) >> 4
-
-    cv2.imwrite(dst_path, dst)
-    return
+def round_error_diff_floyd_steinberg(src, scan='raster', workers=1, palette=None):
+    return round_error_diffusion(src, 'floyd-steinberg', scan, workers, palette)
 
 
 algoritms = {'thresh': round_to_nearest_dithering2,
              'rdith': round_random_dithering2,
              'odith': round_ordered_dithering2,
+             'bnoise': round_blue_noise_dithering,
              'ediff1': round_error_diff_fwd,
              'ediff2': round_error_diff_fwd_bwd,
-             'floyd-stein': round_error_diff_floyd_steinberg
+             'floyd-stein': round_error_diff_floyd_steinberg,
+             'jjn': partial(round_error_diffusion, kernel='jarvis'),
+             'stucki': partial(round_error_diffusion, kernel='stucki'),
+             'sierra': partial(round_error_diffusion, kernel='sierra'),
+             'atkinson': partial(round_error_diffusion, kernel='atkinson')
              }
 
+# algorithms that take a --scan order and --workers: (kernel, default scan)
+diffusion_algoritms = {'ediff1': ('carry', 'raster'),
+                       'ediff2': ('carry', 'serpentine'),
+                       'floyd-stein': ('floyd-steinberg', 'raster'),
+                       'jjn': ('jarvis', 'raster'),
+                       'stucki': ('stucki', 'raster'),
+                       'sierra': ('sierra', 'raster'),
+                       'atkinson': ('atkinson', 'raster')
+                       }
+
+# algorithms whose pattern depends on the position of a strip, they take y0
+tiled_algoritms = ['rdith', 'odith', 'bnoise']
+
+
+def run_all(src, algs=None, options=None):
+    """Run algorithms (all of them by default) on one grayscale image.
+
+    options maps an algorithm name to its keyword arguments. Returns a dict
+    of results keyed by algorithm name.
+    """
+    options = options or {}
+    return {alg: algoritms[alg](src, **options.get(alg, {}))
+            for alg in (algs or algoritms)}
+
+
+def split_strips(src, strip_height=diffusion.STRIP_HEIGHT):
+    return (src[y:y + strip_height] for y in range(0, src.shape[0], strip_height))
+
+
+def save(dst_path, strips, width, height, binary=True, effort='default', dpi=None, color=False):
+    """Write result strips to dst_path. PBM, PNG and TIFF are written as
+    1-bit images from bit-packed strips, other formats, and results that
+    are not binary or are color (see quantize.py), go to cv2.imwrite.
+    effort trades encoding speed for size, see images.py; dpi is recorded
+    in PNG and TIFF files."""
+    dst = bitmap.open_writer(dst_path, width, height, binary, images.zlib_levels[effort], dpi,
+                             color)
+    if dst is None:
+        images.write(dst_path, np.vstack(list(strips)), effort)
+        return
+
+    with dst:
+        for out in strips:
+            dst.write(bitmap.pack(out) if dst.packed else out)
+
+
+def convert(src_path, outputs, options=None, profile=None, width=None, effort='default'):
+    """Decode src_path once and write the result of every algorithm of
+    outputs, a dict of algorithm name to destination path.
+
+    The image is decoded straight to gray (to color for a color palette)
+    and resampled to width columns if width is given; effort is passed to
+    save(). profile is a profiling.Profile to record the decode, dither and
+    write stages in; the result is then dithered whole before it is
+    written, so that the two stages are timed apart.
+    """
+    options = options or {}
+    with profiling.stage(profile, 'decode', image=src_path):
+        src = images.read(src_path, needs_color(options), width)
+    write_results(src, src_path, outputs, options, profile, effort)
+
+
+def needs_color(options):
+    return any(o.get('palette') is not None and quantize.is_color(o['palette'])
+               for o in options.values())
+
+
+def write_results(src, src_path, outputs, options, profile=None, effort='default', dpi=None):
+    """Dither src with every algorithm of outputs and save the results,
+    the loop of convert(); the profile stages carry dpi if it is given."""
+    height, width = src.shape[:2]
+    info = {'image': src_path}
+    if dpi is not None:
+        info['dpi'] = dpi
+
+    for alg, dst_path in outputs.items():
+        alg_options = options.get(alg, {})
+        with profiling.stage(profile, 'dither', alg=alg, shape=list(src.shape), **info):
+            if alg_options.get('workers', 1) > 1:
+                strips = [algoritms[alg](src, **alg_options)]
+            else:
+                strips = dither_strips(split_strips(src), alg, alg_options)
+            if profile is not None:
+                strips = list(strips)
+        palette = alg_options.get('palette')
+        with profiling.stage(profile, 'write', alg=alg, path=dst_path, **info):
+            save(dst_path, strips, width, height, quantize.is_binary(palette), effort, dpi,
+                 palette is not None and quantize.is_color(palette))
+
+
+def pyramid_shapes(shape, src_dpi, dpis):
+    """(dpi, (height, width)) of every target resolution of an image of
+    shape scanned at src_dpi, the largest first."""
+    levels = []
+    for dpi in sorted(set(dpis), reverse=True):
+        if dpi > src_dpi:
+            raise ValueError('a {} dpi level can not be made from a {} dpi source'.format(dpi, src_dpi))
+        size = (max(1, int(round(shape[0] * dpi / float(src_dpi)))),
+                max(1, int(round(shape[1] * dpi / float(src_dpi)))))
+        levels.append((dpi, size))
+    return levels
+
+
+def convert_pyramid(src_path, outputs, options=None, src_dpi=None, profile=None,
+                    effort='default'):
+    """convert() for several resolutions at once: outputs maps (dpi, alg)
+    to a destination path.
+
+    src_path is decoded once; its resolution is src_dpi, read from the file
+    if None, or taken to be the largest output dpi if the file does not say.
+    Every level is area-resampled from the one above it into one of two
+    buffers of the largest level's size, which take turns, and the next
+    level is resampled on a thread while the current one is dithered.
+    """
+    options = options or {}
+    color = needs_color(options)
+    with profiling.stage(profile, 'decode', image=src_path):
+        src = images.read(src_path, color)
+    dpis = set(dpi for dpi, alg in outputs)
+    src_dpi = src_dpi or images.image_dpi(src_path) or max(dpis)
+    levels = pyramid_shapes(src.shape, src_dpi, dpis)
+
+    channels = src.shape[2:]
+    size = max(h * w for dpi, (h, w) in levels) * int(np.prod(channels))
+    buffers = [np.empty(size, dtype=np.uint8), np.empty(size, dtype=np.uint8)]
+
+    def resample(prev, i):
+        shape = levels[i][1] + channels
+        if prev.shape == shape:
+            return prev
+        dst = buffers[i % 2][:int(np.prod(shape))].reshape(shape)
+        return images.resize_to(prev, shape[:2], dst)
+
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        pending = pool.submit(resample, src, 0)
+        for i, (dpi, shape) in enumerate(levels):
+            level = pending.result()
+            if i + 1 < len(levels):
+                pending = pool.submit(resample, level, i + 1)
+            level_outputs = dict((alg, dst_path) for (d, alg), dst_path in outputs.items()
+                                 if d == dpi)
+            write_results(level, src_path, level_outputs, options, profile, effort, dpi)
+
+
+image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff',
+                    '.pgm', '.pbm', '.ppm', '.webp')
+
+
+def dither_strips(strips, alg, options=None):
+    """Run alg over a top-to-bottom sequence of strips of one image and
+    yield the result of every strip, as if the image was run at once."""
+    options = dict(options or {})
+    if alg in diffusion_algoritms:
+        kernel, scan = diffusion_algoritms[alg]
+        for out in diffusion.diffuse_strips(strips, kernel, options.get('scan', scan),
+                                            palette=options.get('palette')):
+            yield out
+        return
+
+    if alg == 'rdith' and options.get('seed') is None:
+        # one seed for the whole image keeps the strips apart
+        options['seed'] = thresholds.new_seed()
+
+    y = 0
+    for strip in strips:
+        if alg in tiled_algoritms:
+            options['y0'] = y
+        yield algoritms[alg](strip, **options)
+        y += strip.shape[0]
+
+
+def read_gray_strips(src_path, strip_height, raw_shape=None):
+    for strip in pnm.read_strips(src_path, strip_height, raw_shape):
+        if strip.ndim > 2:
+            strip = cv2.cvtColor(strip, cv2.COLOR_RGB2GRAY)
+        yield strip
+
+
+def convert_streamed(src_path, outputs, options=None, strip_height=256, raw_shape=None,
+                     profile=None, effort='default'):
+    """convert() for images larger than memory: src_path is a binary PGM/PPM
+    or a raw gray file of raw_shape, outputs are PGM, PBM, PNG or TIFF (PGM
+    only for gray palettes), and only a strip of strip_height rows is held
+    at a time. Reading, dithering and writing are interleaved, so profile
+    gets one stream stage per algorithm."""
+    options = options or {}
+    shape, offset = pnm.read_shape(src_path, raw_shape)
+    height, width = shape[:2]
+
+    for alg, dst_path in outputs.items():
+        alg_options = options.get(alg) or {}
+        palette = alg_options.get('palette')
+        binary = quantize.is_binary(palette)
+        assert is_streamable(dst_path, binary, palette is not None and quantize.is_color(palette))
+        with profiling.stage(profile, 'stream', image=src_path, alg=alg, path=dst_path,
+                             shape=list(shape)):
+            strips = read_gray_strips(src_path, strip_height, raw_shape)
+            save(dst_path, dither_strips(strips, alg, alg_options), width, height, binary, effort)
+
+
+def is_streamable(dst_path, binary=True, color=False):
+    writer = bitmap.writers.get(os.path.splitext(dst_path)[1].lower())
+    return writer is not None and not color and (binary or not writer.packed)
+
+
+def collect_inputs(patterns):
+    """Expand input files, directories and glob patterns into image paths."""
+    src_paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            src_paths.extend(os.path.join(pattern, name) for name in sorted(os.listdir(pattern))
+                             if os.path.splitext(name)[1].lower() in image_extensions)
+        elif any(c in pattern for c in '*?['):
+            src_paths.extend(sorted(glob.glob(pattern)))
+        else:
+            assert os.path.exists(pattern)
+            src_paths.append(pattern)
+    return src_paths
+
+
+def is_batch(args):
+    return len(args.input) > 1 or any(os.path.isdir(p) or any(c in p for c in '*?[')
+                                      for p in args.input)
+
+
+def algorithm_options(alg, args):
+    options = {}
+    if args.palette is not None:
+        options['palette'] = args.palette
+    if alg == 'odith':
+        options['dith_map'] = args.dith_map
+    if alg == 'rdith' and args.seed is not None:
+        options['seed'] = args.seed
+    if alg in ('odith', 'bnoise') and args.dith_size is not None:
+        options['dith_size'] = args.dith_size
+    if alg in diffusion_algoritms:
+        if args.scan is not None:
+            options['scan'] = args.scan
+        if args.workers > 1:
+            options['workers'] = args.workers
+    return options
+
+
+def plan_jobs(args):
+    """List (src_path, outputs, options, stream, settings) for every input
+    image, outputs maps an algorithm name to its destination path and
+    settings holds the keyword arguments of convert() or convert_streamed()."""
+    options = dict((alg, algorithm_options(alg, args)) for alg in args.alg)
+    stream = (args.strip_height, args.raw_size) if args.stream else None
+    settings = {'effort': args.effort}
+    if args.profile:
+        settings['profile'] = profiling.Profile(args.cprofile)
+    if args.dpi:
+        # outputs are keyed by (dpi, alg) and named name_dpi_alg
+        settings['src_dpi'] = args.src_dpi
+        keys = [((dpi, alg), '{}_{}'.format(dpi, alg)) for dpi in args.dpi for alg in args.alg]
+    else:
+        keys = [(alg, alg) for alg in args.alg]
+        if not args.stream:
+            settings['width'] = args.width
+    if not is_batch(args):
+        src_path = args.input[0]
+        dst_file, dst_ext = os.path.splitext(args.output)
+        outputs = dict((key, '{}_{}{}'.format(dst_file, suffix, dst_ext)) for key, suffix in keys)
+        return [(src_path, outputs, options, stream, settings)]
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    jobs = []
+    for src_path in collect_inputs(args.input):
+        name, ext = os.path.splitext(os.path.basename(src_path))
+        ext = args.ext or ext[1:]
+        if args.stream and not is_streamable('.' + ext, quantize.is_binary(args.palette)):
+            ext = 'pgm'
+        outputs = {}
+        for key, suffix in keys:
+            dst_path = os.path.join(args.output, '{}_{}.{}'.format(name, suffix, ext))
+            if args.force or not is_up_to_date(src_path, dst_path):
+                outputs[key] = dst_path
+            else:
+                print('{} -> {}: up to date'.format(src_path, dst_path))
+        if outputs:
+            jobs.append((src_path, outputs, options, stream, settings))
+    return jobs
+
+
+def is_up_to_date(src_path, dst_path):
+    return os.path.exists(dst_path) and os.path.getmtime(dst_path) >= os.path.getmtime(src_path)
+
+
+def run_job(job):
+    """Run a plan_jobs() job, returns (src_path, outputs, seconds, records)
+    with the profile records of the job (None without a profile)."""
+    src_path, outputs, options, stream, settings = job
+    profile = settings.get('profile')
+    if profile is not None:
+        # the settings are shared by every job, each one records its own stages
+        profile = profiling.Profile(profile.cprofile_dir, profile.cprofile_stages)
+        settings = dict(settings, profile=profile)
+    start = time.time()
+    if stream is not None:
+        convert_streamed(src_path, outputs, options, *stream, **settings)
+    elif 'src_dpi' in settings:
+        convert_pyramid(src_path, outputs, options, **settings)
+    else:
+        convert(src_path, outputs, options, **settings)
+    return src_path, outputs, time.time() - start, profile and profile.records
+
 
 def run_algorithm(args):
-    src_path = args.input
-    assert os.path.exists(src_path)
-
-    dst_path = args.output
+    jobs = plan_jobs(args)
+    start = time.time()
+
+    def report(result):
+        src_path, outputs, elapsed, records = result
+        if is_batch(args):
+            print('{} -> {}: {:.3f}s'.format(src_path, ', '.join(outputs.values()), elapsed))
+        if records:
+            profiling.write_jsonl(records, args.profile)
+
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            for result in pool.imap_unordered(run_job, jobs):
+                report(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            report(run_job(job))
 
-    dst_file, dst_ext = os.path.basename(dst_path).split('.')
-    dst_file = '{}_{}.{}'.format(dst_file, args.alg, dst_ext)
+    if is_batch(args):
+        print('{} images in {:.3f}s'.format(len(jobs), time.time() - start))
+    return
 
-    dst_dir = os.path.dirname(dst_path)
-    dst_path = os.path.join(dst_dir, dst_file)
 
-    algoritms[args.alg](src_path, dst_path)
-    return
+def palette_arg(spec):
+    try:
+        return quantize.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def parse_args():
     m = argparse.ArgumentParser(description="Comparison semitone image binary approximation algorithms")
-    m.add_argument("--input", "-i", type=str,
-                   help="Input image", required=True)
+    m.add_argument("--input", "-i", type=str, nargs='+', required=True,
+                   help="Input image, or several images, directories and glob patterns for a batch")
 
     m.add_argument("--output", "-o", type=str, required=True,
-                   help="Image-result")
-    m.add_argument("--alg", "-a", type=str, choices=['thresh', 'rdith', 'odith',
-                                                     'ediff1', 'ediff2', 'floyd-stein'],
-                   help="Select algorithm to use", default='thresh')
+                   help="Image-result, or the output directory for a batch")
+    m.add_argument("--alg", "-a", type=str, nargs='+', choices=list(algoritms) + ['all'],
+                   help="Select algorithms to use, 'all' runs every one", default=['thresh'])
+    m.add_argument("--scan", type=str, choices=list(diffusion.scan_orders),
+                   help="Scan order for error diffusion algorithms", default=None)
+    m.add_argument("--dith-map", type=str, default='bayer',
+                   help="odith threshold map: {} or a matrix file (.npy or text)".format(
+                       ', '.join(thresholds.builders)))
+    m.add_argument("--dith-size", type=int, default=None,
+                   help="odith (16 by default) and bnoise (64) threshold map size")
+    m.add_argument("--seed", type=int, default=None,
+                   help="rdith noise seed, the result is reproducible for a given seed")
+    m.add_argument("--palette", type=palette_arg, default=None,
+                   help="Quantize to a number of grays (4), gray levels (0,128,255) or "
+                        "#rrggbb colors instead of black and white")
+    m.add_argument("--workers", "-w", type=int, default=1,
+                   help="Processes to split error diffusion across")
+    m.add_argument("--jobs", "-j", type=int, default=1,
+                   help="Images to convert in parallel")
+    m.add_argument("--ext", type=str, default=None,
+                   help="Output format for a batch, input format by default")
+    m.add_argument("--force", action='store_true',
+                   help="Convert batch images even if the outputs are up to date")
+    m.add_argument("--stream", action='store_true',
+                   help="Read binary PGM/PPM (or --raw-size) input strip by strip, write PGM/PBM/PNG/TIFF")
+    m.add_argument("--strip-height", type=int, default=256,
+                   help="Rows held in memory at a time with --stream")
+    m.add_argument("--width", type=int, default=None,
+                   help="Resample the input to this many columns before dithering")
+    m.add_argument("--dpi", type=int, nargs='+', default=None,
+                   help="Write every algorithm at each of these resolutions (e.g. 72 300 600), "
+                        "resampled from one decode of the input")
+    m.add_argument("--src-dpi", type=int, default=None,
+                   help="Input resolution for --dpi, read from PNG/JPEG files by default")
+    m.add_argument("--effort", type=str, choices=images.efforts, default='default',
+                   help="Encoder setting: fast to write quickly, small for smaller files")
+    m.add_argument("--profile", type=str, default=None, metavar='JSONL',
+                   help="Append wall time, CPU time and peak memory of every stage as JSON lines "
+                        "('-' is stdout); memory tracing slows the Python loops down")
+    m.add_argument("--cprofile", type=str, default=None, metavar='DIR',
+                   help="With --profile, dump a cProfile of every dither stage to DIR")
+    m.add_argument("--raw-size", type=int, nargs=2, metavar=('HEIGHT', 'WIDTH'), default=None,
+                   help="Input is headerless 8-bit gray of this size, implies --stream")
 
     args = m.parse_args()
+    if 'all' in args.alg:
+        args.alg = list(algoritms)
+    if args.raw_size is not None:
+        args.stream = True
+    if args.cprofile and not args.profile:
+        m.error("--cprofile needs --profile")
+    if args.stream and (args.width or args.dpi):
+        m.error("--stream writes the input size, --width and --dpi need a full decode")
+    if args.dpi and args.width:
+        m.error("--dpi and --width both set the output size")
+    if args.src_dpi and not args.dpi:
+        m.error("--src-dpi only applies to --dpi")
+    if not is_batch(args):
+        if not os.path.isfile(args.input[0]):
+            m.error("no such input: {}".format(args.input[0]))
+        try:
+            images.check_output(args.output)
+        except ValueError as e:
+            m.error(str(e))
+    elif args.ext:
+        try:
+            images.check_output('x.' + args.ext)
+        except ValueError as e:
+            m.error(str(e))
+    if args.palette is not None and quantize.is_binary(args.palette):
+        args.palette = None
+    if args.palette is not None and quantize.is_color(args.palette):
+        if args.stream:
+            m.error("--stream reads gray images, a color --palette needs a full decode")
+        if args.workers > 1:
+            m.error("a color --palette is diffused on one process, use --jobs")
+    if args.stream and args.workers > 1:
+        m.error("--stream runs on one process per image, use --jobs")
+    if args.jobs > 1 and args.workers > 1:
+        m.error("--jobs and --workers can not be combined")
+    if not any(alg in diffusion_algoritms for alg in args.alg) and (args.scan or args.workers > 1):
+        m.error("--scan and --workers only apply to error diffusion algorithms")
+    if args.workers > 1:
+        for alg in args.alg:
+            if alg in diffusion_algoritms:
+                kernel, scan = diffusion_algoritms[alg]
+                if not diffusion.is_splittable(kernel, args.scan or scan):
+                    m.error("{} with {} scan runs on one process, use --jobs".format(
+                        alg, args.scan or scan))
     return args
 
 
@@ -0,0 +1,433 @@
+from collections import namedtuple
+from multiprocessing import shared_memory
+import multiprocessing as mp
+import multiprocessing.connection
+import numpy as np
+
+import quantize
+
+
+# taps are (dy, dx, weight) with dx > 0 pointing along the scan direction,
+# each tap receives (weight * error) // divisor
+Kernel = namedtuple('Kernel', ['taps', 'divisor'])
+
+kernels = {
+    'carry': Kernel(((0, 1, 1),), 1),
+    'floyd-steinberg': Kernel(((0, 1, 7),
+                               (1, -1, 3), (1, 0, 5), (1, 1, 1)), 16),
+    'jarvis': Kernel(((0, 1, 7), (0, 2, 5),
+                      (1, -2, 3), (1, -1, 5), (1, 0, 7), (1, 1, 5), (1, 2, 3),
+                      (2, -2, 1), (2, -1, 3), (2, 0, 5), (2, 1, 3), (2, 2, 1)), 48),
+    'stucki': Kernel(((0, 1, 8), (0, 2, 4),
+                      (1, -2, 2), (1, -1, 4), (1, 0, 8), (1, 1, 4), (1, 2, 2),
+                      (2, -2, 1), (2, -1, 2), (2, 0, 4), (2, 1, 2), (2, 2, 1)), 42),
+    'sierra': Kernel(((0, 1, 5), (0, 2, 3),
+                      (1, -2, 2), (1, -1, 4), (1, 0, 5), (1, 1, 4), (1, 2, 2),
+                      (2, -1, 2), (2, 0, 3), (2, 1, 2)), 32),
+    'atkinson': Kernel(((0, 1, 1), (0, 2, 1),
+                        (1, -1, 1), (1, 0, 1), (1, 1, 1),
+                        (2, 0, 1)), 8),
+}
+
+# scan direction of row y: 1 is left to right, -1 right to left;
+# the kernel is mirrored together with the scan
+scan_orders = {
+    'raster': lambda y: 1,
+    'serpentine': lambda y: 1 - 2 * (y % 2),
+}
+
+STRIP_HEIGHT = 256
+# columns a wavefront worker quantizes between two progress updates
+CHUNK_WIDTH = 128
+
+
+def kernel_depth(kernel):
+    return max(dy for dy, dx, w in kernel.taps) + 1
+
+
+def kernel_reach(kernel):
+    return max(abs(dx) for dy, dx, w in kernel.taps)
+
+
+def is_splittable(kernel, scan):
+    """Whether diffuse_parallel can run kernel (a name) with scan: a
+    wavefront needs every row scanned in the same direction."""
+    k = kernels[kernel]
+    return kernel_depth(k) == 1 or scan_orders[scan](1) == scan_orders[scan](0)
+
+
+def _quantizer(levels):
+    """(nearest-level table, low, high) of a gray palette for _scan_line,
+    None for black and white; values are clamped to low..high first."""
+    if levels is None:
+        return None
+    low, high = quantize.diffusion_bounds(levels)
+    return quantize.gray_quantizer(levels), low, high
+
+
+def _sweep_columns(strip, y0, kernel, scan, threshold, levels=None):
+    """Kernels confined to the current row leave rows independent, so walk
+    all rows of the strip at once, one column per step."""
+    h, w = strip.shape
+    reach = kernel_reach(kernel)
+    flip = np.array([scan_orders[scan](y0 + i) < 0 for i in range(h)])
+    if levels is not None:
+        table, low, high = _quantizer(levels)
+        table = np.array(table, dtype=np.int16)
+        offset = -quantize.DIFFUSION_RANGE[0]
+
+    # column-major working copy in scan coordinates, padded past the row end
+    work = np.zeros((w + reach, h), dtype=np.int16)
+    work[:w] = strip.T
+    work[:w, flip] = work[w - 1::-1, flip]
+    out = np.empty((w, h), dtype=np.uint8)
+
+    for x in range(w):
+        v = work[x]
+        if levels is None:
+            q = 255 * (v > threshold).astype(np.int16)
+        else:
+            v = np.clip(v, low, high)
+            q = table[v + offset]
+        out[x] = q
+        err = v - q
+        for dy, dx, wt in kernel.taps:
+            work[x + dx] += (wt * err) // kernel.divisor
+
+    out[:, flip] = out[::-1, flip]
+    return out.T.copy()
+
+
+def _scan_line(cur, w, row_taps, div, threshold, quant=None):
+    """Quantize cur[:w] in order, pushing the in-row share of every error
+    ahead into cur; cur must be padded past w by the kernel reach.
+
+    quant is a nearest-level table with its clamp bounds (see _quantizer)
+    replacing the black and white threshold."""
+    out = [0] * w
+    err = [0] * w
+    if quant is None:
+        for x in range(w):
+            v = cur[x]
+            if v > threshold:
+                out[x] = 255
+                v -= 255
+            err[x] = v
+            for dx, wt in row_taps:
+                cur[x + dx] += (wt * v) // div
+        return out, err
+
+    table, low, high = quant
+    offset = -quantize.DIFFUSION_RANGE[0]
+    for x in range(w):
+        v = min(max(cur[x], low), high)
+        q = table[v + offset]
+        out[x] = q
+        v -= q
+        err[x] = v
+        for dx, wt in row_taps:
+            cur[x + dx] += (wt * v) // div
+    return out, err
+
+
+def _scan_line_color(cur, w, row_taps, div, lut, colors, bounds):
+    """_scan_line for [b, g, r] pixels; lut is quantize.color_lut as nested
+    lists, colors the palette as lists and bounds its diffusion_bounds.
+    Returns palette indices and errors."""
+    shift = 8 - quantize.LUT_BITS
+    (lb, lg, lr), (hb, hg, hr) = bounds
+    out = [0] * w
+    err = [None] * w
+    for x in range(w):
+        b, g, r = cur[x]
+        b = min(max(b, lb), hb)
+        g = min(max(g, lg), hg)
+        r = min(max(r, lr), hr)
+        k = lut[min(max(b, 0), 255) >> shift][min(max(g, 0), 255) >> shift][min(max(r, 0), 255) >> shift]
+        out[x] = k
+        pb, pg, pr = colors[k]
+        b -= pb
+        g -= pg
+        r -= pr
+        err[x] = (b, g, r)
+        for dx, wt in row_taps:
+            t = cur[x + dx]
+            t[0] += (wt * b) // div
+            t[1] += (wt * g) // div
+            t[2] += (wt * r) // div
+    return out, err
+
+
+def _scan_rows(strip, y0, buf, kernel, scan, threshold, quant=None):
+    """Walk the strip row by row, carrying error below the current row in
+    buf, an int16 ring of kernel_depth rows padded by kernel_reach.
+
+    Only the taps on the current row are applied pixel by pixel, the rows
+    below get the whole row's error in one shifted add once it is known.
+    """
+    h, w = strip.shape
+    reach = kernel_reach(kernel)
+    div = kernel.divisor
+    row_taps = [(dx, wt) for dy, dx, wt in kernel.taps if dy == 0]
+    dst = np.empty((h, w), dtype=np.uint8)
+
+    for i in range(h):
+        step = scan_orders[scan](y0 + i)
+        line = buf[0, reach:reach + w] + strip[i]
+        cur = line[::step].tolist() + [0] * reach
+        out, err = _scan_line(cur, w, row_taps, div, threshold, quant)
+
+        dst[i] = out[::step]
+        err = np.array(err[::step], dtype=np.int16)
+        for dy, dx, wt in kernel.taps:
+            if dy > 0:
+                x0 = reach + step * dx
+                buf[dy, x0:x0 + w] += (wt * err) // div
+        buf[:-1] = buf[1:]
+        buf[-1] = 0
+
+    return dst
+
+
+def _scan_rows_color(strip, y0, buf, kernel, scan, lut, colors, bounds):
+    """_scan_rows for a BGR strip and a color palette, buf has a third axis
+    for the channels; returns palette indices."""
+    h, w = strip.shape[:2]
+    reach = kernel_reach(kernel)
+    div = kernel.divisor
+    row_taps = [(dx, wt) for dy, dx, wt in kernel.taps if dy == 0]
+    dst = np.empty((h, w), dtype=np.uint8)
+
+    for i in range(h):
+        step = scan_orders[scan](y0 + i)
+        line = buf[0, reach:reach + w] + strip[i]
+        cur = line[::step].tolist() + [[0, 0, 0] for _ in range(reach)]
+        out, err = _scan_line_color(cur, w, row_taps, div, lut, colors, bounds)
+
+        dst[i] = out[::step]
+        err = np.array(err[::step], dtype=np.int16)
+        for dy, dx, wt in kernel.taps:
+            if dy > 0:
+                x0 = reach + step * dx
+                buf[dy, x0:x0 + w] += (wt * err) // div
+        buf[:-1] = buf[1:]
+        buf[-1] = 0
+
+    return dst
+
+
+def diffuse_strips(strips, kernel='floyd-steinberg', scan='raster', threshold=128, palette=None):
+    """Error-diffuse a top-to-bottom sequence of uint8 strips of one image.
+
+    Yields a 0/255 uint8 strip for every input strip; the error that spills
+    below a strip is carried into the next one. With a gray palette (see
+    quantize.py) pixels go to its nearest levels instead of black and white,
+    with a color palette the strips are BGR and so are the results.
+    """
+    kernel = kernels[kernel]
+    depth = kernel_depth(kernel)
+    in_row = depth == 1
+    reach = kernel_reach(kernel)
+    color = palette is not None and quantize.is_color(palette)
+    if color:
+        lut = quantize.color_lut(palette).tolist()
+        colors = palette.astype(np.int64).tolist()
+        bounds = quantize.diffusion_bounds(palette)
+    buf = None
+    y = 0
+
+    for strip in strips:
+        if color:
+            if buf is None:
+                buf = np.zeros((depth, strip.shape[1] + 2 * reach, 3), dtype=np.int16)
+            yield palette[_scan_rows_color(strip, y, buf, kernel, scan, lut, colors, bounds)]
+        elif in_row:
+            yield _sweep_columns(strip, y, kernel, scan, threshold, palette)
+        else:
+            if buf is None:
+                buf = np.zeros((depth, strip.shape[1] + 2 * reach), dtype=np.int16)
+            yield _scan_rows(strip, y, buf, kernel, scan, threshold, _quantizer(palette))
+        y += strip.shape[0]
+
+
+def _attach(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _band_worker(src_name, dst_name, shape, y0, y1, kernel, scan, threshold, levels):
+    src_shm, src = _attach(src_name, shape, np.uint8)
+    dst_shm, dst = _attach(dst_name, shape, np.uint8)
+    dst[y0:y1] = _sweep_columns(src[y0:y1], y0, kernels[kernel], scan, threshold, levels)
+    del src, dst
+    src_shm.close()
+    dst_shm.close()
+
+
+def _wavefront_worker(src_name, dst_name, ring_name, shape, ring_shape, first, workers,
+                      kernel, threshold, levels, done, cond, chunks):
+    """Quantize rows first, first + workers, ... chunk by chunk.
+
+    Chunk c of row y starts once row y - 1 has finished chunk c + 1, which
+    also covers every row above it. Row y keeps its pending error in ring
+    slot y % len(ring) and clears the slot when it finishes the row.
+
+    Every finished chunk of row y releases chunks[y % workers] once, and
+    row y + 1, the only row waiting on it, acquires exactly as many
+    releases as row y makes; done[y] is set under cond when row y is
+    finished, for the rare wait on a ring slot.
+    """
+    src_shm, src = _attach(src_name, shape, np.uint8)
+    dst_shm, dst = _attach(dst_name, shape, np.uint8)
+    ring_shm, ring = _attach(ring_name, ring_shape, np.int16)
+
+    kernel = kernels[kernel]
+    h, w = shape
+    slots = ring_shape[0]
+    depth = kernel_depth(kernel)
+    reach = kernel_reach(kernel)
+    div = kernel.divisor
+    row_taps = [(dx, wt) for dy, dx, wt in kernel.taps if dy == 0]
+    below = [(dy, dx, wt) for dy, dx, wt in kernel.taps if dy > 0]
+    quant = _quantizer(levels)
+    nchunks = -(-w // CHUNK_WIDTH)
+
+    for y in range(first, h, workers):
+        # the slots this row deposits into must have been released
+        last_owner = y + depth - 1 - slots
+        if last_owner >= 0 and not done[last_owner]:
+            with cond:
+                cond.wait_for(lambda: done[last_owner])
+
+        slot = ring[y % slots]
+        above = chunks[(y - 1) % workers]
+        carry = [0] * reach
+        for c in range(nchunks):
+            # row y - 1 has to be min(c + 2, nchunks) chunks in
+            if y > 0:
+                for _ in range(min(c + 2, nchunks) - min(c + 1, nchunks) + (c == 0)):
+                    above.acquire()
+
+            a = c * CHUNK_WIDTH
+            b = min(a + CHUNK_WIDTH, w)
+            cur = (slot[reach + a:reach + b] + src[y, a:b]).tolist() + [0] * reach
+            for j in range(reach):
+                cur[j] += carry[j]
+            out, err = _scan_line(cur, b - a, row_taps, div, threshold, quant)
+            carry = cur[b - a:]
+
+            dst[y, a:b] = out
+            err = np.array(err, dtype=np.int16)
+            for dy, dx, wt in below:
+                x0 = reach + a + dx
+                ring[(y + dy) % slots, x0:x0 + b - a] += (wt * err) // div
+
+            if c == nchunks - 1:
+                slot[:] = 0
+                with cond:
+                    done[y] = 1
+                    cond.notify_all()
+            chunks[y % workers].release()
+
+    del src, dst, ring, slot
+    src_shm.close()
+    dst_shm.close()
+    ring_shm.close()
+
+
+def _run_workers(procs):
+    for p in procs:
+        p.start()
+    try:
+        pending = list(procs)
+        while pending:
+            for sentinel in mp.connection.wait([p.sentinel for p in pending]):
+                p = next(p for p in pending if p.sentinel == sentinel)
+                p.join()
+                if p.exitcode != 0:
+                    raise RuntimeError('diffusion worker exited with code {}'.format(p.exitcode))
+                pending.remove(p)
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+
+def diffuse_parallel(src, kernel='floyd-steinberg', scan='raster', threshold=128, workers=2,
+                     palette=None):
+    """Error-diffuse src on several processes, output matches diffuse().
+
+    Kernels confined to one row split the image into bands of rows. Other
+    kernels run as a wavefront: row y + 1 follows row y a couple of chunks
+    behind, which needs every row to be scanned in the same direction.
+    Color palettes are diffused on one process only.
+    """
+    if palette is not None and quantize.is_color(palette):
+        raise ValueError('color palettes can not be diffused on several processes')
+    k = kernels[kernel]
+    in_row = kernel_depth(k) == 1
+    h, w = src.shape
+    step = scan_orders[scan](0)
+    if not is_splittable(kernel, scan):
+        raise ValueError('{} scan can not be split into a wavefront'.format(scan))
+
+    # the wavefront works in scan coordinates
+    flip = not in_row and step < 0
+    if flip:
+        src = src[:, ::-1]
+
+    src_shm = shared_memory.SharedMemory(create=True, size=max(src.size, 1))
+    dst_shm = shared_memory.SharedMemory(create=True, size=max(src.size, 1))
+    ring_shm = None
+    try:
+        np.ndarray(src.shape, dtype=np.uint8, buffer=src_shm.buf)[:] = src
+
+        if in_row:
+            bounds = np.linspace(0, h, workers + 1).astype(int)
+            procs = [mp.Process(target=_band_worker,
+                                args=(src_shm.name, dst_shm.name, src.shape, y0, y1,
+                                      kernel, scan, threshold, palette))
+                     for y0, y1 in zip(bounds[:-1], bounds[1:]) if y1 > y0]
+        else:
+            if CHUNK_WIDTH < 2 * kernel_reach(k):
+                raise ValueError('CHUNK_WIDTH is narrower than twice the kernel reach')
+            ring_shape = (workers + kernel_depth(k), w + 2 * kernel_reach(k))
+            ring_shm = shared_memory.SharedMemory(create=True, size=2 * ring_shape[0] * ring_shape[1])
+            np.ndarray(ring_shape, dtype=np.int16, buffer=ring_shm.buf)[:] = 0
+
+            workers = min(workers, h)
+            done = mp.RawArray('b', h)
+            cond = mp.Condition()
+            chunks = [mp.Semaphore(0) for _ in range(workers)]
+            procs = [mp.Process(target=_wavefront_worker,
+                                args=(src_shm.name, dst_shm.name, ring_shm.name, src.shape,
+                                      ring_shape, first, workers, kernel, threshold,
+                                      palette, done, cond, chunks))
+                     for first in range(workers)]
+
+        _run_workers(procs)
+        dst = np.ndarray(src.shape, dtype=np.uint8, buffer=dst_shm.buf).copy()
+    finally:
+        for shm in (src_shm, dst_shm, ring_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    return dst[:, ::-1] if flip else dst
+
+
+def diffuse(src, kernel='floyd-steinberg', scan='raster', threshold=128, workers=1, palette=None):
+    """Error-diffuse a whole grayscale image, returns a 0/255 uint8 image,
+    or an image of palette entries, see diffuse_strips()."""
+    if workers > 1:
+        return diffuse_parallel(src, kernel, scan, threshold, workers, palette)
+
+    dst = np.empty(src.shape, dtype=np.uint8)
+    strips = (src[y:y + STRIP_HEIGHT] for y in range(0, src.shape[0], STRIP_HEIGHT))
+
+    y = 0
+    for out in diffuse_strips(strips, kernel, scan, threshold, palette):
+        dst[y:y + out.shape[0]] = out
+        y += out.shape[0]
+    return dst
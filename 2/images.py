@@ -0,0 +1,191 @@
+import os.path
+import struct
+import cv2
+import numpy as np
+
+import bitmap
+import pnm
+
+
+# Decoding goes straight to the channels the algorithms need; JPEG sources
+# for a smaller target width are decoded at 1/2, 1/4 or 1/8 size by the
+# JPEG decoder itself. Encoding takes an effort: fast, default or small.
+
+efforts = ('fast', 'default', 'small')
+
+# zlib level of the 1-bit PNG and TIFF writers
+zlib_levels = {'fast': 1, 'default': 6, 'small': 9}
+
+reduced_flags = {(False, 1): cv2.IMREAD_GRAYSCALE,
+                 (False, 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                 (False, 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                 (False, 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+                 (True, 1): cv2.IMREAD_COLOR,
+                 (True, 2): cv2.IMREAD_REDUCED_COLOR_2,
+                 (True, 4): cv2.IMREAD_REDUCED_COLOR_4,
+                 (True, 8): cv2.IMREAD_REDUCED_COLOR_8}
+
+jpeg_extensions = ('.jpg', '.jpeg')
+
+
+def image_size(path):
+    """(height, width) from the header of a PNG, JPEG or PNM file, None for
+    other formats or unreadable headers."""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        if ext == '.png':
+            head = f.read(24)
+            if head[:8] != b'\x89PNG\r\n\x1a\n' or head[12:16] != b'IHDR':
+                return None
+            width, height = struct.unpack('>II', head[16:24])
+            return height, width
+        if ext in ('.pgm', '.ppm'):
+            try:
+                magic, width, height, maxval = pnm.read_header(f)
+            except RuntimeError:
+                return None
+            return height, width
+        if ext in jpeg_extensions:
+            return _jpeg_size(f)
+    return None
+
+
+def _jpeg_size(f):
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        if marker[1] in (0xd8, 0x01) or 0xd0 <= marker[1] <= 0xd7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        # start of frame markers, except DHT, JPG and DAC
+        if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return height, width
+        f.seek(length - 2, 1)
+
+
+def image_dpi(path):
+    """Horizontal resolution in dots per inch from a PNG pHYs chunk or a
+    JPEG JFIF header, None if the file does not say."""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        if ext == '.png':
+            if f.read(8) != b'\x89PNG\r\n\x1a\n':
+                return None
+            while True:
+                head = f.read(8)
+                if len(head) < 8:
+                    return None
+                length, tag = struct.unpack('>I4s', head)
+                if tag == b'pHYs':
+                    x, y, unit = struct.unpack('>IIB', f.read(9))
+                    # unit 1 is the meter
+                    return int(round(x * 0.0254)) if unit == 1 else None
+                if tag == b'IDAT':
+                    return None
+                f.seek(length + 4, 1)
+        if ext in jpeg_extensions:
+            head = f.read(18)
+            if head[:4] != b'\xff\xd8\xff\xe0' or head[6:11] != b'JFIF\x00':
+                return None
+            unit, x, y = struct.unpack('>BHH', head[13:18])
+            # unit 1 is dots per inch, 2 dots per centimeter
+            if unit == 1:
+                return x
+            if unit == 2:
+                return int(round(x * 2.54))
+    return None
+
+
+def reduction(src_width, width):
+    """Largest decoder reduction that keeps src_width at least width wide."""
+    for factor in (8, 4, 2):
+        if src_width // factor >= width:
+            return factor
+    return 1
+
+
+def resize(src, width):
+    """Resample src to width columns, keeping the aspect ratio; area
+    averaging when shrinking."""
+    h, w = src.shape[:2]
+    if w == width:
+        return src
+    height = max(1, int(round(h * width / float(w))))
+    interpolation = cv2.INTER_AREA if width < w else cv2.INTER_LINEAR
+    return cv2.resize(src, (width, height), interpolation=interpolation)
+
+
+def resize_to(src, shape, dst=None):
+    """Area-resample src to shape (height, width), into dst if given."""
+    if src.shape[:2] == tuple(shape):
+        if dst is None:
+            return src
+        dst[...] = src
+        return dst
+    return cv2.resize(src, (shape[1], shape[0]), dst=dst, interpolation=cv2.INTER_AREA)
+
+
+def read(path, color=False, width=None):
+    """Decode path as gray (or BGR with color) uint8, resampled to width
+    columns if width is given."""
+    if not os.path.isfile(path):
+        raise IOError('no such image: {}'.format(path))
+
+    factor = 1
+    if width and os.path.splitext(path)[1].lower() in jpeg_extensions:
+        size = image_size(path)
+        if size is not None:
+            factor = reduction(size[1], width)
+
+    src = cv2.imread(path, reduced_flags[(color, factor)])
+    if src is None:
+        raise IOError('cv2 can not decode {}'.format(path))
+    if width:
+        src = resize(src, width)
+    return src
+
+
+def decode(data, color=False):
+    """Decode an encoded image held in bytes, see read()."""
+    src = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), reduced_flags[(color, 1)])
+    if src is None:
+        raise ValueError('not an image cv2 can decode')
+    return src
+
+
+def imwrite_params(ext, effort='default'):
+    """cv2.imwrite parameters of an effort for formats left to cv2."""
+    ext = ext.lower()
+    if effort == 'default':
+        return []
+    fast = effort == 'fast'
+    if ext == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, 1 if fast else 9]
+    if ext in jpeg_extensions:
+        return [cv2.IMWRITE_JPEG_OPTIMIZE, 0 if fast else 1]
+    if ext in ('.tif', '.tiff'):
+        # libtiff codes: no compression, deflate
+        return [cv2.IMWRITE_TIFF_COMPRESSION, 1 if fast else 8]
+    return []
+
+
+def write(path, img, effort='default'):
+    if not cv2.imwrite(path, img, imwrite_params(os.path.splitext(path)[1], effort)):
+        raise IOError('cv2 could not write {}'.format(path))
+
+
+def check_output(path):
+    """Raise ValueError unless path has an extension some writer handles
+    and lives in an existing directory."""
+    ext = os.path.splitext(path)[1].lower()
+    if not ext:
+        raise ValueError('{} has no file extension to pick a format from'.format(path))
+    if ext not in bitmap.writers and not cv2.haveImageWriter(path):
+        raise ValueError('no writer for {} files'.format(ext))
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        raise ValueError('output directory {} does not exist'.format(directory))
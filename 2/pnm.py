@@ -0,0 +1,108 @@
+import numpy as np
+
+
+# binary netpbm formats with 8-bit samples: magic -> channels
+channels = {b'P5': 1, b'P6': 3}
+
+
+def read_header(f):
+    """Parse a binary PGM/PPM header from an open file.
+
+    Returns (magic, width, height, maxval) and leaves f at the first sample.
+    """
+    tokens = []
+    while len(tokens) < 4:
+        c = f.read(1)
+        if not c:
+            raise RuntimeError('PNM: truncated header')
+        if c == b'#':
+            f.readline()
+        elif c.isspace():
+            continue
+        else:
+            token = c
+            while True:
+                c = f.read(1)
+                if not c or c.isspace():
+                    break
+                token += c
+            tokens.append(token)
+
+    magic = tokens[0]
+    if magic not in channels:
+        raise RuntimeError('PNM: unsupported format {}'.format(magic.decode('ascii', 'replace')))
+    width, height, maxval = (int(t) for t in tokens[1:])
+    if maxval > 255:
+        raise RuntimeError('PNM: only 8-bit samples are supported')
+    return magic, width, height, maxval
+
+
+def read_shape(path, raw_shape=None):
+    """Return the array shape of the image and the offset of its samples;
+    a headerless gray file of raw_shape = (height, width) has no header."""
+    if raw_shape is not None:
+        return tuple(raw_shape), 0
+
+    with open(path, 'rb') as f:
+        magic, width, height, maxval = read_header(f)
+        offset = f.tell()
+
+    shape = (height, width) if channels[magic] == 1 else (height, width, channels[magic])
+    return shape, offset
+
+
+def read_strips(path, strip_height, raw_shape=None):
+    """Yield the image top to bottom as (rows, width[, 3]) uint8 strips of
+    strip_height rows, reading each from disk only when it is asked for."""
+    shape, offset = read_shape(path, raw_shape)
+    row_size = int(np.prod(shape[1:]))
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for y in range(0, shape[0], strip_height):
+            rows = min(strip_height, shape[0] - y)
+            strip = np.fromfile(f, dtype=np.uint8, count=rows * row_size)
+            if strip.size != rows * row_size:
+                raise RuntimeError('PNM: truncated image data')
+            yield strip.reshape((rows,) + shape[1:])
+
+
+class PgmWriter(object):
+    """Write a binary PGM strip by strip."""
+    packed = False
+
+    def __init__(self, path, width, height):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.f = open(path, 'wb')
+        self.f.write(self.header().encode('ascii'))
+
+    def header(self):
+        return 'P5\n{} {}\n255\n'.format(self.width, self.height)
+
+    def write(self, strip):
+        self.f.write(np.ascontiguousarray(strip, dtype=np.uint8).tobytes())
+        self.rows += strip.shape[0]
+
+    def close(self):
+        self.f.close()
+        if self.rows != self.height:
+            raise RuntimeError('PNM: wrote {} of {} rows'.format(self.rows, self.height))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+class PbmWriter(PgmWriter):
+    """Write a binary PBM from bit-packed strips."""
+    packed = True
+
+    def header(self):
+        return 'P4\n{} {}\n'.format(self.width, self.height)
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profile(object):
+    """Wall time, CPU time and peak traced memory of named stages.
+
+    Every stage becomes a record dict with the keyword arguments it was
+    opened with. Memory is traced with tracemalloc, which slows down
+    Python-heavy stages such as error diffusion; CPU time counts this
+    process only. With cprofile_dir set, the stages named in cprofile_stages
+    are also run under cProfile and dumped there as .prof files.
+    """
+
+    def __init__(self, cprofile_dir=None, cprofile_stages=('dither',)):
+        self.cprofile_dir = cprofile_dir
+        self.cprofile_stages = cprofile_stages
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, **info):
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+
+        profiler = None
+        if self.cprofile_dir and name in self.cprofile_stages:
+            profiler = cProfile.Profile()
+
+        start = time.time()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record = dict(info, stage=name, start=start, pid=os.getpid(),
+                          wall_s=time.perf_counter() - wall,
+                          cpu_s=time.process_time() - cpu,
+                          peak_mb=(tracemalloc.get_traced_memory()[1] - base) / 2.0 ** 20)
+            if not tracing:
+                tracemalloc.stop()
+            if profiler is not None:
+                record['cprofile'] = self._dump(profiler, name, info)
+            self.records.append(record)
+
+    def _dump(self, profiler, name, info):
+        if not os.path.isdir(self.cprofile_dir):
+            os.makedirs(self.cprofile_dir)
+        parts = [os.path.splitext(os.path.basename(str(info.get('image', ''))))[0],
+                 info.get('alg'), name]
+        path = os.path.join(self.cprofile_dir,
+                            '_'.join(str(p) for p in parts if p) + '.prof')
+        profiler.dump_stats(path)
+        return path
+
+
+@contextmanager
+def _no_stage():
+    yield
+
+
+def stage(profile, name, **info):
+    """profile.stage(name, **info), or nothing when profile is None."""
+    if profile is None:
+        return _no_stage()
+    return profile.stage(name, **info)
+
+
+def write_jsonl(records, path):
+    """Append records as JSON lines to path, '-' is stdout."""
+    lines = ''.join(json.dumps(r, sort_keys=True) + '\n' for r in records)
+    if path == '-':
+        sys.stdout.write(lines)
+        sys.stdout.flush()
+        return
+    with open(path, 'a') as f:
+        f.write(lines)
@@ -0,0 +1,182 @@
+import hashlib
+from functools import lru_cache
+import numpy as np
+
+import thresholds
+
+
+# A palette is either a sorted uint8 array of gray levels or a (k, 3) uint8
+# array of BGR colors (the channel order cv2 decodes to). Nearest-level
+# search goes through 256-entry tables for gray and a 3D table over the
+# top LUT_BITS bits of each channel for color.
+
+LUT_BITS = 6
+
+# error diffusion clamps a value to this far outside the palette range,
+# else the error of a palette without black or white grows without bound
+DIFFUSION_MARGIN = 255
+# every value a clamped diffusion can reach, as a half-open range
+DIFFUSION_RANGE = (-DIFFUSION_MARGIN, 256 + DIFFUSION_MARGIN)
+
+
+def gray_levels(n):
+    """n evenly spaced gray levels from black to white."""
+    return np.unique(np.round(np.linspace(0, 255, n)).astype(np.uint8))
+
+
+def parse(spec):
+    """'4' is 4 evenly spaced grays, '0,96,255' lists gray levels and
+    '#000000,#ff0000,...' lists RGB colors."""
+    spec = spec.strip()
+    if spec.isdigit():
+        n = int(spec)
+        if n < 2:
+            raise ValueError('palette needs at least 2 levels')
+        return gray_levels(n)
+
+    items = [item.strip() for item in spec.split(',') if item.strip()]
+    if len(items) < 2:
+        raise ValueError('palette needs at least 2 entries')
+    if all(item.startswith('#') and len(item) == 7 for item in items):
+        rgb = [[int(item[i:i + 2], 16) for i in (1, 3, 5)] for item in items]
+        if len(set(map(tuple, rgb))) < 2:
+            raise ValueError('palette needs at least 2 distinct colors')
+        return np.array(rgb, dtype=np.uint8)[:, ::-1].copy()
+    levels = [int(item) for item in items]
+    if any(level < 0 or level > 255 for level in levels):
+        raise ValueError('gray levels must be in 0..255')
+    levels = np.unique(np.array(levels, dtype=np.uint8))
+    if len(levels) < 2:
+        raise ValueError('palette needs at least 2 distinct levels')
+    return levels
+
+
+def is_color(palette):
+    return palette.ndim == 2
+
+
+def is_binary(palette):
+    return palette is None or (not is_color(palette) and list(palette) == [0, 255])
+
+
+def _nearest_gray(values, levels):
+    levels = levels.astype(np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    # midpoints between levels, a value on a midpoint goes up
+    mid = (levels[:-1] + levels[1:] + 1) // 2
+    return levels[np.searchsorted(mid, values, side='right')]
+
+
+@lru_cache(maxsize=32)
+def _gray_tables(key):
+    levels = np.frombuffer(key, dtype=np.uint8)
+    gray = np.arange(256)
+
+    nearest = _nearest_gray(gray, levels).astype(np.uint8)
+    nearest.flags.writeable = False
+
+    # for ordered and random dithering: the levels around every gray and
+    # its position between them scaled to 0..255; grays outside the palette
+    # range get its first or last level for both, whatever the noise
+    k = np.clip(np.searchsorted(levels, gray, side='right') - 1, 0, len(levels) - 2)
+    low = levels[k].astype(np.int64)
+    high = levels[k + 1].astype(np.int64)
+    below = gray < levels[0]
+    above = gray > levels[-1]
+    low[below] = high[below] = levels[0]
+    low[above] = high[above] = levels[-1]
+    pos = np.where(below | above, 0, np.round((gray - low) * 255.0 / np.maximum(high - low, 1)))
+    pos = pos.astype(np.uint8)
+    tables = (nearest, low.astype(np.uint8), high.astype(np.uint8), pos)
+    for t in tables:
+        t.flags.writeable = False
+
+    lo, hi = DIFFUSION_RANGE
+    quantizer = _nearest_gray(np.arange(lo, hi), levels).tolist()
+    return tables + (quantizer,)
+
+
+def gray_tables(levels):
+    """(nearest, low, high, pos) 256-entry tables of a gray palette."""
+    return _gray_tables(levels.tobytes())[:4]
+
+
+def gray_quantizer(levels):
+    """List of the nearest level of every value in DIFFUSION_RANGE, to be
+    indexed with value - DIFFUSION_RANGE[0]."""
+    return _gray_tables(levels.tobytes())[4]
+
+
+def diffusion_bounds(palette):
+    """(low, high) error diffusion clamps values to, per channel as lists
+    for a color palette."""
+    p = palette.astype(np.int64)
+    return (p.min(axis=0) - DIFFUSION_MARGIN).tolist(), (p.max(axis=0) + DIFFUSION_MARGIN).tolist()
+
+
+def _build_color_lut(palette, bits):
+    step = 1 << (8 - bits)
+    centers = np.arange(1 << bits) * step + (step - 1) / 2.0
+    b, g, r = np.meshgrid(centers, centers, centers, indexing='ij')
+    best = np.full(b.shape, np.inf)
+    index = np.zeros(b.shape, dtype=np.uint8)
+    for i, (pb, pg, pr) in enumerate(palette.astype(np.float64)):
+        d = (b - pb) ** 2 + (g - pg) ** 2 + (r - pr) ** 2
+        closer = d < best
+        best[closer] = d[closer]
+        index[closer] = i
+    return index
+
+
+@lru_cache(maxsize=8)
+def _color_lut(key, bits):
+    palette = np.frombuffer(key, dtype=np.uint8).reshape(-1, 3)
+    name = 'palette_{}_{}'.format(hashlib.sha1(key).hexdigest()[:16], bits)
+    lut = thresholds.disk_cached(name, lambda: _build_color_lut(palette, bits))
+    lut.flags.writeable = False
+    return lut
+
+
+def color_lut(palette, bits=LUT_BITS):
+    """Index of the nearest palette color for every cell of a
+    2**bits x 2**bits x 2**bits BGR grid, cached like threshold maps."""
+    if len(palette) > 256:
+        raise ValueError('palettes are limited to 256 colors')
+    return _color_lut(palette.tobytes(), bits)
+
+
+def nearest_color(img, palette):
+    """Palette indices of the nearest colors of a BGR image (any integer
+    type, values are clipped to 0..255)."""
+    lut = color_lut(palette)
+    cells = np.clip(img, 0, 255).astype(np.uint8) >> (8 - LUT_BITS)
+    return lut[cells[..., 0], cells[..., 1], cells[..., 2]]
+
+
+def color_spread(palette):
+    """Typical per-channel distance between neighbouring colors, the
+    amplitude of the threshold offset for ordered and random dithering."""
+    p = palette.astype(np.int64)
+    d = np.abs(p[:, None, :] - p[None, :, :]).max(axis=2)
+    d[np.arange(len(p)), np.arange(len(p))] = 255 * 4
+    return float(d.min(axis=1).mean())
+
+
+def threshold(src, palette):
+    """Nearest palette entry of every pixel."""
+    if is_color(palette):
+        return palette[nearest_color(src, palette)]
+    return gray_tables(palette)[0][src]
+
+
+def dither(src, palette, noise):
+    """Ordered or random dithering to a palette; noise is a uint8 threshold
+    plane of src's shape (a tiled threshold map or random values), used the
+    way the binary algorithms compare src > noise."""
+    if is_color(palette):
+        offset = (noise.astype(np.float64) - 127.5) * (color_spread(palette) / 255.0)
+        biased = np.rint(src + offset[..., None]).astype(np.int16)
+        return palette[nearest_color(biased, palette)]
+
+    nearest, low, high, pos = gray_tables(palette)
+    return np.where(pos[src] > noise, high[src], low[src])
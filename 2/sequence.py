@@ -0,0 +1,176 @@
+from __future__ import print_function
+import os.path
+import re
+import threading
+import time
+import argparse
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import convert
+import quantize
+import thresholds
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+_done = object()
+
+
+def expand_frames(patterns):
+    """Frame paths of printf-style patterns (frame_%04d.png, numbered from 0
+    or 1 up to the first gap), directories and glob patterns, in order."""
+    src_paths = []
+    for pattern in patterns:
+        if not re.search(r'%0?\d*d', pattern):
+            src_paths.extend(convert.collect_inputs([pattern]))
+            continue
+        i = 0 if os.path.exists(pattern % 0) else 1
+        while os.path.exists(pattern % i):
+            src_paths.append(pattern % i)
+            i += 1
+    return src_paths
+
+
+def background(items, depth):
+    """Iterate items on a worker thread, at most depth items ahead of the
+    consumer; an exception on the thread is raised in the consumer."""
+    q = queue.Queue(depth)
+
+    def produce():
+        try:
+            for item in items:
+                q.put(item)
+        except Exception as e:
+            q.put(_Failure(e))
+        q.put(_done)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        item = q.get()
+        if item is _done:
+            break
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+    thread.join()
+
+
+class BackgroundWriter(object):
+    """Save results on a worker thread behind a queue of depth results."""
+
+    def __init__(self, depth):
+        self.error = None
+        self.q = queue.Queue(depth)
+        self.thread = threading.Thread(target=self._consume)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _consume(self):
+        while True:
+            item = self.q.get()
+            if item is _done:
+                return
+            if self.error is not None:
+                continue
+            dst_path, dst, binary, color = item
+            try:
+                convert.save(dst_path, [dst], dst.shape[1], dst.shape[0], binary, color=color)
+            except Exception as e:
+                self.error = e
+
+    def write(self, dst_path, dst, binary=True, color=False):
+        """Queue dst for convert.save(), binary and color as in save()."""
+        if self.error is not None:
+            raise self.error
+        self.q.put((dst_path, dst, binary, color))
+
+    def close(self):
+        self.q.put(_done)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def dither_frames(frames, algs, options=None, stable=False):
+    """Run algs over (src_path, frame) pairs, yield (src_path, {alg: result}).
+
+    With stable set every frame gets the same rdith seed, so a still area
+    of the sequence dithers the same way in every frame (so does any seed
+    given in options); odith and bnoise are stable by construction.
+    """
+    options = options or {}
+    seed = thresholds.new_seed() if stable else None
+    for src_path, src in frames:
+        alg_options = dict((alg, dict(options.get(alg, {}))) for alg in algs)
+        if seed is not None and 'rdith' in algs:
+            alg_options['rdith'].setdefault('seed', seed)
+        yield src_path, convert.run_all(src, algs, alg_options)
+
+
+def convert_sequence(src_paths, dst_dir, algs, options=None, ext=None, stable=False, depth=4):
+    """Dither a frame sequence with decoding and encoding overlapped with
+    the compute on background threads; outputs are named like a batch."""
+    if not os.path.isdir(dst_dir):
+        os.makedirs(dst_dir)
+
+    options = options or {}
+    # decoded to color for a color palette, like convert()
+    load = convert.load_color if convert.needs_color(options) else convert.load_gray
+    frames = background(((p, load(p)) for p in src_paths), depth)
+    writer = BackgroundWriter(depth * len(algs))
+    start = time.time()
+    count = 0
+    try:
+        for src_path, results in dither_frames(frames, algs, options, stable):
+            name, src_ext = os.path.splitext(os.path.basename(src_path))
+            for alg, dst in results.items():
+                dst_path = os.path.join(dst_dir, '{}_{}.{}'.format(name, alg, ext or src_ext[1:]))
+                palette = options.get(alg, {}).get('palette')
+                writer.write(dst_path, dst, quantize.is_binary(palette),
+                             palette is not None and quantize.is_color(palette))
+            count += 1
+    finally:
+        writer.close()
+
+    elapsed = time.time() - start
+    print('{} frames in {:.3f}s, {:.2f} frames/s'.format(count, elapsed, count / elapsed if elapsed else 0))
+
+
+def parse_args():
+    m = argparse.ArgumentParser(description="Dither an image sequence with overlapped decode, dither and encode")
+    m.add_argument("--input", "-i", type=str, nargs='+', required=True,
+                   help="Frame pattern (frame_%%04d.png), directory or glob pattern")
+    m.add_argument("--output", "-o", type=str, required=True,
+                   help="Output directory")
+    m.add_argument("--alg", "-a", type=str, nargs='+', choices=list(convert.algoritms) + ['all'],
+                   help="Select algorithms to use, 'all' runs every one", default=['thresh'])
+    m.add_argument("--ext", type=str, default=None,
+                   help="Output format, input format by default")
+    m.add_argument("--stable", action='store_true',
+                   help="Reuse the rdith random plane in every frame")
+    m.add_argument("--queue", type=int, default=4,
+                   help="Frames decoded ahead of the compute")
+
+    args = m.parse_args()
+    if 'all' in args.alg:
+        args.alg = list(convert.algoritms)
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    convert_sequence(expand_frames(args.input), args.output, args.alg,
+                     ext=args.ext, stable=args.stable, depth=args.queue)
+
+    exit(0)
@@ -0,0 +1,234 @@
+from __future__ import print_function
+import os
+import asyncio
+import argparse
+import concurrent.futures
+import tempfile
+from urllib.parse import urlsplit, parse_qs
+
+import convert
+import diffusion
+import images
+import quantize
+import thresholds
+
+
+# Minimal HTTP/1.1 front end for convert.py: POST /dither?alg=floyd-stein&ext=png
+# with the encoded image as the body answers with the encoded result. The
+# dithering runs on a pool of processes started once, so a request pays no
+# interpreter, NumPy or cv2 startup.
+
+content_types = {'png': 'image/png', 'pbm': 'image/x-portable-bitmap',
+                 'pgm': 'image/x-portable-graymap', 'bmp': 'image/bmp',
+                 'tif': 'image/tiff', 'tiff': 'image/tiff',
+                 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           408: 'Request Timeout', 411: 'Length Required', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+HEADER_TIMEOUT = 30
+# blue-noise maps take a void-and-cluster build per size, keep it short
+MAX_DITH_SIZE = 256
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def request_options(query):
+    """(alg, ext, effort, options) from the query string; parameters are
+    named like the convert.py options."""
+    params = dict((k, v[-1]) for k, v in parse_qs(query).items())
+    alg = params.get('alg')
+    if alg not in convert.algoritms:
+        raise RequestError(400, 'alg must be one of {}'.format(', '.join(convert.algoritms)))
+    ext = params.get('ext', 'png').lower()
+    if ext not in content_types:
+        raise RequestError(400, 'ext must be one of {}'.format(', '.join(content_types)))
+    effort = params.get('effort', 'default')
+    if effort not in images.efforts:
+        raise RequestError(400, 'effort must be one of {}'.format(', '.join(images.efforts)))
+
+    # threshold map files are not exposed, only the built-in kinds
+    dith_map = params.get('dith_map', 'bayer')
+    scan = params.get('scan')
+    if dith_map not in thresholds.builders or scan not in list(diffusion.scan_orders) + [None]:
+        raise RequestError(400, 'unknown dith_map or scan')
+    try:
+        args = argparse.Namespace(
+            dith_map=dith_map, scan=scan, workers=1,
+            dith_size=int(params['dith_size']) if 'dith_size' in params else None,
+            seed=int(params['seed']) if 'seed' in params else None,
+            palette=quantize.parse(params['palette']) if 'palette' in params else None)
+    except (ValueError, OverflowError) as e:
+        raise RequestError(400, str(e))
+    if args.dith_size is not None and not 0 < args.dith_size <= MAX_DITH_SIZE:
+        raise RequestError(400, 'dith_size must be in 1..{}'.format(MAX_DITH_SIZE))
+    if args.palette is not None and quantize.is_binary(args.palette):
+        args.palette = None
+    if args.palette is not None and ext == 'pbm':
+        raise RequestError(400, 'PBM holds black and white only, use another ext with a palette')
+    return alg, ext, effort, convert.algorithm_options(alg, args)
+
+
+def dither_bytes(data, alg, ext, effort, options):
+    """Decode data, run alg and encode the result as ext; runs in a pool
+    process. Results go through convert.save, so PBM, PNG and TIFF come out
+    as 1-bit images."""
+    palette = options.get('palette')
+    src = images.decode(data, palette is not None and quantize.is_color(palette))
+    height, width = src.shape[:2]
+
+    fd, path = tempfile.mkstemp(suffix='.' + ext)
+    os.close(fd)
+    try:
+        strips = convert.dither_strips(convert.split_strips(src), alg, options)
+        convert.save(path, strips, width, height, quantize.is_binary(palette), effort,
+                     color=palette is not None and quantize.is_color(palette))
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def _warm_up():
+    # the pool starts its processes ahead of the first request
+    return os.getpid()
+
+
+class DitherServer(object):
+    """Serve dithering requests with at most max_pending of them accepted at
+    a time; the rest are turned away with 503 instead of queueing up."""
+
+    def __init__(self, jobs, max_bytes, max_pending):
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.pending = 0
+        self.pool = concurrent.futures.ProcessPoolExecutor(jobs)
+        for future in [self.pool.submit(_warm_up) for _ in range(jobs)]:
+            future.result()
+
+    async def handle(self, reader, writer):
+        try:
+            status, body, content_type = await self.respond(reader)
+        except RequestError as e:
+            status, body, content_type = e.status, (str(e) + '\n').encode(), 'text/plain'
+        head = ('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+                'Connection: close\r\n'.format(status, reasons[status], content_type, len(body)))
+        if status == 503:
+            head += 'Retry-After: 1\r\n'
+        try:
+            writer.write((head + '\r\n').encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEADER_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RequestError(408, 'timed out reading the request')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            raise RequestError(400, 'malformed request head')
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise RequestError(400, 'malformed request line')
+        headers = dict((k.strip().lower(), v.strip())
+                       for k, _, v in (line.partition(':') for line in lines[1:] if line))
+
+        url = urlsplit(target)
+        if url.path != '/dither':
+            raise RequestError(404, 'POST images to /dither')
+        if method != 'POST':
+            raise RequestError(405, 'POST images to /dither')
+        alg, ext, effort, options = request_options(url.query)
+
+        if 'content-length' not in headers:
+            raise RequestError(411, 'Content-Length is required')
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise RequestError(400, 'bad Content-Length')
+        if length > self.max_bytes:
+            raise RequestError(413, 'images are limited to {} bytes'.format(self.max_bytes))
+
+        # backpressure: refuse work before reading the body
+        if self.pending >= self.max_pending:
+            raise RequestError(503, 'busy, {} requests in progress'.format(self.pending))
+        self.pending += 1
+        try:
+            try:
+                data = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise RequestError(408, 'timed out reading the body')
+            except asyncio.IncompleteReadError:
+                raise RequestError(400, 'truncated body')
+
+            loop = asyncio.get_running_loop()
+            try:
+                body = await loop.run_in_executor(self.pool, dither_bytes, data, alg, ext,
+                                                  effort, options)
+            except ValueError as e:
+                raise RequestError(400, str(e))
+            except Exception as e:
+                raise RequestError(500, '{}: {}'.format(type(e).__name__, e))
+        finally:
+            self.pending -= 1
+        return 200, body, content_types[ext]
+
+    def close(self):
+        self.pool.shutdown()
+
+
+async def serve(args):
+    server = DitherServer(args.jobs, args.max_bytes, args.max_pending or 2 * args.jobs)
+    try:
+        if args.socket:
+            listener = await asyncio.start_unix_server(server.handle, path=args.socket)
+            where = args.socket
+        else:
+            listener = await asyncio.start_server(server.handle, args.host, args.port)
+            where = 'http://{}:{}'.format(args.host, args.port)
+        print('serving on {} with {} processes'.format(where, args.jobs))
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def parse_args():
+    m = argparse.ArgumentParser(description="Serve convert.py algorithms to local clients")
+    m.add_argument("--host", type=str, default='127.0.0.1',
+                   help="Address to listen on, loopback by default")
+    m.add_argument("--port", type=int, default=8765,
+                   help="TCP port to listen on")
+    m.add_argument("--socket", type=str, default=None,
+                   help="Listen on this Unix socket instead of TCP")
+    m.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                   help="Worker processes")
+    m.add_argument("--max-bytes", type=int, default=64 * 2 ** 20,
+                   help="Largest accepted request body")
+    m.add_argument("--max-pending", type=int, default=None,
+                   help="Requests accepted at a time, twice --jobs by default; more get 503")
+    return m.parse_args()
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+    exit(0)
@@ -0,0 +1,223 @@
+import os
+import tempfile
+from functools import lru_cache
+import numpy as np
+
+
+# A threshold map is a uint8 array m such that a pixel of gray level g is
+# white where g > m; ordered dithering tiles it over the image. Maps are
+# built from a rank matrix (0 .. n-1 in the order the cells light up) and
+# cached in memory and in CACHE_DIR.
+
+CACHE_DIR = os.environ.get('MIPTCG_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'miptcg'))
+
+# rows of a random threshold plane drawn from one stream
+NOISE_ROWS = 64
+
+
+def bayer(size):
+    """Recursive Bayer matrix for sizes 2**k and 3 * 2**k."""
+    n = size
+    while n > 3 and n % 2 == 0:
+        n //= 2
+    if n == 2:
+        m = np.array([[0, 2], [3, 1]], dtype=np.int64)
+    elif n == 3:
+        m = np.array([[0, 7, 3], [6, 5, 2], [4, 1, 8]], dtype=np.int64)
+    else:
+        raise ValueError('Bayer matrix size must be 2**k or 3 * 2**k, got {}'.format(size))
+
+    while m.shape[0] < size:
+        m = 4 * m
+        m = np.vstack([np.hstack([m, m + 2]),
+                       np.hstack([m + 3, m + 1])])
+    return m
+
+
+def clustered_dot(size):
+    """Clustered-dot matrix: cells light up from the center of the tile
+    outwards, ring by ring, so dots grow as solid clusters."""
+    c = (size - 1) / 2.0
+    y, x = np.mgrid[:size, :size]
+    dist = np.hypot(y - c, x - c).ravel()
+    angle = np.arctan2(y - c, x - c).ravel()
+    order = np.lexsort((angle, np.round(dist, 6)))
+    ranks = np.empty(size * size, dtype=np.int64)
+    ranks[order] = np.arange(size * size)
+    return ranks.reshape(size, size)
+
+
+def void_and_cluster(size, sigma=1.5, seed=0):
+    """Blue-noise rank matrix by Ulichney's void-and-cluster method.
+
+    The energy of a pattern is its toroidal Gaussian blur; the tightest
+    cluster is the set pixel with the highest energy and the largest void
+    the empty pixel with the lowest. The seed is fixed so that every run,
+    and every cache, gets the same mask.
+    """
+    n = size * size
+    d = np.minimum(np.arange(size), size - np.arange(size))
+    kernel = np.exp(-(d[:, None] ** 2 + d[None, :] ** 2) / (2.0 * sigma ** 2))
+    # kernel centered on (iy, ix) is a window of the doubled kernel
+    kernel2 = np.tile(kernel, (2, 2))
+
+    def toggle(pattern, energy, p, value):
+        iy, ix = divmod(p, size)
+        pattern.flat[p] = value
+        window = kernel2[size - iy:2 * size - iy, size - ix:2 * size - ix]
+        if value:
+            energy += window
+        else:
+            energy -= window
+
+    def tightest_cluster(pattern, energy):
+        return int(np.argmax(np.where(pattern, energy, -np.inf)))
+
+    def largest_void(pattern, energy):
+        return int(np.argmin(np.where(pattern, np.inf, energy)))
+
+    # initial pattern: random minority pixels, relaxed until no cluster
+    # pixel can be moved into a bigger void
+    pattern = np.zeros((size, size), dtype=bool)
+    energy = np.zeros((size, size))
+    rng = np.random.RandomState(seed)
+    for p in rng.choice(n, max(n // 10, 1), replace=False):
+        toggle(pattern, energy, p, True)
+    while True:
+        c = tightest_cluster(pattern, energy)
+        toggle(pattern, energy, c, False)
+        v = largest_void(pattern, energy)
+        if v == c:
+            toggle(pattern, energy, c, True)
+            break
+        toggle(pattern, energy, v, True)
+
+    ranks = np.empty(n, dtype=np.int64)
+    ones = int(pattern.sum())
+
+    # ranks below the initial pattern: take clusters away
+    p1, e1 = pattern.copy(), energy.copy()
+    for rank in range(ones - 1, -1, -1):
+        c = tightest_cluster(p1, e1)
+        toggle(p1, e1, c, False)
+        ranks[c] = rank
+
+    # ranks above it: fill voids; the blur is linear, so the tightest
+    # cluster of zeros in the upper half is the same largest void
+    for rank in range(ones, n):
+        v = largest_void(pattern, energy)
+        toggle(pattern, energy, v, True)
+        ranks[v] = rank
+
+    return ranks.reshape(size, size)
+
+
+builders = {'bayer': bayer,
+            'cluster': clustered_dot,
+            'blue-noise': void_and_cluster}
+
+
+def ranks_to_map(ranks):
+    """Turn a rank matrix into a threshold map.
+
+    Rank r lights up for gray g where g * n / 255 > r, n being the number of
+    cells; the comparison is done once for all 256 gray levels, in the
+    float arithmetic odith always used.
+    """
+    n = ranks.size
+    levels = n / 255 * np.arange(256)
+    first_on = np.searchsorted(levels, ranks, side='right')
+    return (first_on - 1).astype(np.uint8)
+
+
+def normalize(values):
+    """Rank arbitrary user map values, ties broken in row-major order."""
+    values = np.asarray(values, dtype=np.float64)
+    ranks = np.empty(values.size, dtype=np.int64)
+    ranks[np.argsort(values, axis=None, kind='stable')] = np.arange(values.size)
+    return ranks.reshape(values.shape)
+
+
+def _read_user_map(path):
+    if path.endswith('.npy'):
+        return np.load(path)
+    return np.loadtxt(path, ndmin=2)
+
+
+def disk_cached(name, build):
+    """Load array name from CACHE_DIR, or build it and store it there.
+
+    The file is written under a temporary name and renamed, so concurrent
+    processes never see a partial file.
+    """
+    path = os.path.join(CACHE_DIR, name + '.npy')
+    try:
+        return np.load(path)
+    except (IOError, OSError, ValueError):
+        pass
+
+    m = build()
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, m)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        pass
+    return m
+
+
+@lru_cache(maxsize=32)
+def _cached_map(kind, size, mtime):
+    if kind in builders:
+        m = disk_cached('{}_{}'.format(kind, size), lambda: ranks_to_map(builders[kind](size)))
+    else:
+        m = ranks_to_map(normalize(_read_user_map(kind)))
+    m.flags.writeable = False
+    return m
+
+
+def threshold_map(kind='bayer', size=16):
+    """Threshold map of a built-in kind (see builders) and size, or of
+    a user-supplied matrix file (.npy or text) whose values give the order
+    in which cells light up; size is ignored for files."""
+    if kind in builders:
+        return _cached_map(kind, size, None)
+    return _cached_map(kind, None, os.path.getmtime(kind))
+
+
+def tile(m, shape, y0=0, x0=0):
+    """Repeat map m over an image of shape whose top-left pixel sits at
+    (y0, x0) of the whole image."""
+    h, w = m.shape
+    y0 %= h
+    x0 %= w
+    reps = (-(-(y0 + shape[0]) // h), -(-(x0 + shape[1]) // w))
+    return np.tile(m, reps)[y0:y0 + shape[0], x0:x0 + shape[1]]
+
+
+def new_seed():
+    """A fresh seed for random_plane, for callers that were given none."""
+    return np.random.SeedSequence().entropy
+
+
+def random_plane(shape, seed, y0=0):
+    """Uniform random uint8 threshold plane for rows y0 .. y0 + shape[0] of
+    an image shape[1] wide.
+
+    Every band of NOISE_ROWS image rows has its own generator stream
+    derived from seed and the band number, so a strip of the image gets the
+    same values however the image is split and whoever draws it.
+    """
+    h, w = shape
+    first = y0 // NOISE_ROWS
+    last = max(y0 + h - 1, y0) // NOISE_ROWS
+    bands = []
+    for band in range(first, last + 1):
+        rng = np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(band,))))
+        bands.append(rng.integers(0, 256, size=(NOISE_ROWS, w), dtype=np.uint8))
+    start = y0 - first * NOISE_ROWS
+    return np.concatenate(bands)[start:start + h]
@@ -112,14 +112,169 @@ class Face(object):
         self._nx, self._ny, self._nz = normal3f
 
 
+# attributes of the array storage of a Mesh
+arrayNames = ('positions', 'fileNormals', 'texCoords', 'faceOffsets', 'faceIndices',
+              'faceNormals', 'vertexNormals', 'normalMask',
+              'edgeArray', 'edgeFaceOffsets', 'edgeFaces')
+
+
 class Mesh(object):
     def __init__(self):
-        self.vertices = []
-        self.faces = list()
+        self._vertices = []
+        self._faces = list()
         self.pointData = list()
         self.colorData = list()
-        self.edges = list()
-        self.edgeNormals = list()
+        self._edges = list()
+        self._edgeNormals = list()
+
+        # Array storage, filled by setArrays(). When positions is set the
+        # arrays are the mesh and vertices, faces, edges and edgeNormals are
+        # built from them on first use.
+        self.positions = None       # (n, 3) coordinates
+        self.fileNormals = None     # (n, 3) normals read from the file
+        self.texCoords = None       # (n, 2) s, t
+        self.faceOffsets = None     # (f + 1,) start of each face in faceIndices
+        self.faceIndices = None     # vertex indices of all faces, concatenated
+        self.faceNormals = None     # (f, 3)
+        self.vertexNormals = None   # (n, 3)
+        self.normalMask = None      # (n,) vertices that have a normal
+        self.edgeArray = None       # (e, 2) vertex pairs, in order of appearance
+        self.edgeFaceOffsets = None # (e + 1,) start of each edge in edgeFaces
+        self.edgeFaces = None       # faces of every edge, in face order
+
+    @classmethod
+    def fromArrays(cls, positions, faceIndices, faceOffsets=None, normals=None, texCoords=None):
+        m = cls()
+        m.setArrays(positions, faceIndices, faceOffsets, normals, texCoords)
+        return m
+
+    def setArrays(self, positions, faceIndices, faceOffsets=None, normals=None, texCoords=None):
+        """Use arrays as the mesh. faceIndices is either an (f, k) array of
+        faces with k vertices each, or the concatenated vertex indices of
+        all faces with faceOffsets holding where every face starts."""
+        faceIndices = np.asarray(faceIndices)
+        if faceOffsets is None:
+            nFaces, k = faceIndices.shape
+            faceOffsets = np.arange(nFaces + 1, dtype=np.int64) * k
+        self.positions = np.asarray(positions)
+        self.faceIndices = faceIndices.reshape(-1).astype(np.int64, copy=False)
+        self.faceOffsets = np.asarray(faceOffsets, dtype=np.int64)
+        self.fileNormals = normals
+        self.texCoords = texCoords
+        self.faceNormals = self.vertexNormals = self.normalMask = None
+        self.edgeArray = self.edgeFaceOffsets = self.edgeFaces = None
+        self._vertices = self._faces = self._edges = self._edgeNormals = None
+
+    def arrays(self):
+        """The array storage that is set, by attribute name."""
+        return dict((name, getattr(self, name)) for name in arrayNames
+                    if getattr(self, name) is not None)
+
+    @classmethod
+    def fromArrayDict(cls, arrays):
+        """Mesh from arrays() of another mesh, derived arrays included."""
+        m = cls()
+        for name in arrayNames:
+            setattr(m, name, arrays.get(name))
+        m._vertices = m._faces = m._edges = m._edgeNormals = None
+        return m
+
+    def isArrayBacked(self):
+        return self.positions is not None
+
+    def faceCounts(self):
+        return np.diff(self.faceOffsets)
+
+    def faceArray(self):
+        """Faces as an (f, k) array if they all have k vertices, else None."""
+        counts = self.faceCounts()
+        if len(counts) and (counts == counts[0]).all():
+            return self.faceIndices.reshape(len(counts), counts[0])
+        return None
+
+    @property
+    def vertices(self):
+        if self._vertices is None:
+            self._vertices = self._buildVertices()
+        return self._vertices
+
+    @vertices.setter
+    def vertices(self, value):
+        self._vertices = value
+
+    @property
+    def faces(self):
+        if self._faces is None:
+            self._faces = self._buildFaces()
+        return self._faces
+
+    @faces.setter
+    def faces(self, value):
+        self._faces = value
+
+    @property
+    def edges(self):
+        if self._edges is None:
+            if self.edgeArray is None:
+                self.calculateEdges()
+            self._edges = [set(e) for e in self.edgeArray.tolist()]
+        return self._edges
+
+    @edges.setter
+    def edges(self, value):
+        self._edges = value
+
+    @property
+    def edgeNormals(self):
+        if self._edgeNormals is None:
+            self._edgeNormals = self._buildEdgeNormals()
+        return self._edgeNormals
+
+    @edgeNormals.setter
+    def edgeNormals(self, value):
+        self._edgeNormals = value
+
+    def _buildVertices(self):
+        vertices = []
+        normals, mask = self.vertexNormals, self.normalMask
+        if normals is None and self.fileNormals is not None:
+            normals, mask = self.fileNormals, None
+        normals = None if normals is None else normals.tolist()
+        mask = None if mask is None else mask.tolist()
+        st = None if self.texCoords is None else self.texCoords.tolist()
+        for i, (x, y, z) in enumerate(self.positions.tolist()):
+            v = Vertex()
+            v._x, v._y, v._z = x, y, z
+            v._hasCoords = True
+            if normals is not None:
+                v._nx, v._ny, v._nz = normals[i]
+                v._hasNormal = mask is None or mask[i]
+            if st is not None:
+                v._s, v._t = st[i]
+                v._hasST = True
+            vertices.append(v)
+        return vertices
+
+    def _buildFaces(self):
+        faces = []
+        indices, offsets = self.faceIndices.tolist(), self.faceOffsets.tolist()
+        normals = None if self.faceNormals is None else self.faceNormals.tolist()
+        for i in range(len(offsets) - 1):
+            f = Face()
+            f.set(indices[offsets[i]:offsets[i + 1]])
+            if normals is not None:
+                f.setNormal(normals[i])
+            faces.append(f)
+        return faces
+
+    def _buildEdgeNormals(self):
+        if self.edgeArray is None:
+            self.calculateEdges()
+        # normals of all faces sharing an edge, concatenated: length 6 for
+        # an edge between two faces
+        normals = self.faceNormals[self.edgeFaces].reshape(-1).tolist()
+        offsets = (self.edgeFaceOffsets * 3).tolist()
+        return [tuple(normals[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
 
     def addVertex(self, v):
         self.vertices.append(v)
@@ -130,7 +285,47 @@ class Mesh(object):
     def addFace(self, f):
         self.faces.append(f)
 
+    def calculateEdges(self):
+        """Fill edgeArray, edgeFaces and edgeFaceOffsets from the faces: edges
+        are the unordered pairs of consecutive vertices of a face, numbered
+        in order of first appearance like the edges list of
+        calculateNormals. Array backed meshes build them on first use."""
+        offsets, indices = self.faceOffsets, self.faceIndices
+        nVertices = max(len(self.positions), 1)
+        faceOf = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        following = np.arange(1, len(indices) + 1)
+        following[offsets[1:] - 1] = offsets[:-1]
+        a, b = indices, indices[following]
+        pairs = np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1)
+
+        # a stable sort groups the occurrences of every edge in face order
+        order = np.argsort(pairs[:, 0] * nVertices + pairs[:, 1], kind='stable')
+        sortedPairs = pairs[order]
+        newGroup = np.ones(len(order), dtype=bool)
+        newGroup[1:] = (sortedPairs[1:] != sortedPairs[:-1]).any(axis=1)
+        starts = np.flatnonzero(newGroup)
+        groupSizes = np.diff(np.append(starts, len(order)))
+
+        # first occurrences in file order are the edges in appearance order
+        firstSeen = np.zeros(len(order), dtype=bool)
+        firstSeen[order[starts]] = True
+        edgeId = (np.cumsum(firstSeen) - 1)[order[starts]]
+        self.edgeArray = pairs[firstSeen]
+
+        sizes = np.zeros(len(starts), dtype=np.int64)
+        sizes[edgeId] = groupSizes
+        self.edgeFaceOffsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        destination = (np.repeat(self.edgeFaceOffsets[edgeId] - starts, groupSizes) +
+                       np.arange(len(order)))
+        self.edgeFaces = np.empty(len(order), dtype=np.int64)
+        self.edgeFaces[destination] = faceOf[order]
+        self._edges = self._edgeNormals = None
+
     def calculateNormals(self):
+        if self.isArrayBacked():
+            self._calculateNormalArrays()
+            return
+
         nVerticesPerFace = len(self.faces[0].vertices())
 
         for faceIndex in range(len(self.faces)):
@@ -155,6 +350,44 @@ class Mesh(object):
         for i in range(len(self.vertices)):
             self.vertices[i].divideNormal(nVerticesPerFace)
 
+
+    def _calculateNormalArrays(self):
+        # the same results as the loop above: face normals from the first
+        # three vertices, summed onto the vertices (and any normals read from
+        # the file) and divided by the vertex count of the first face
+        offsets, indices = self.faceOffsets, self.faceIndices
+        counts = np.diff(offsets)
+        nFaces, nVertices = len(counts), len(self.positions)
+        first = offsets[:-1]
+        p = self.positions
+        v1 = p.take(indices[first], axis=0).astype(np.float64)
+        a = p.take(indices[first + 1], axis=0) - v1
+        b = p.take(indices[first + 2], axis=0) - v1
+        n = np.empty_like(a)
+        n[:, 0] = a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1]
+        n[:, 1] = a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2]
+        n[:, 2] = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n /= np.sqrt((n * n).sum(axis=1))[:, None]
+        self.faceNormals = n
+
+        if self.fileNormals is not None:
+            normals = self.fileNormals.astype(np.float64)
+        else:
+            normals = np.zeros((nVertices, 3))
+        for c in range(3):
+            normals[:, c] += np.bincount(indices, weights=np.repeat(n[:, c], counts),
+                                         minlength=nVertices)
+        if nFaces:
+            normals /= counts[0]
+        self.vertexNormals = normals
+        self.normalMask = np.bincount(indices, minlength=nVertices) > 0
+        if self.fileNormals is not None:
+            self.normalMask[:] = True
+        self.edgeArray = self.edgeFaceOffsets = self.edgeFaces = None
+
+        self._vertices = self._faces = self._edges = self._edgeNormals = None
+
     def genPointData(self):
         for faceIndex in range(len(self.faces)):
             face = self.faces[faceIndex]
@@ -326,6 +559,12 @@ class Mesh(object):
         glEnd()
 
     def scale(self):
+        if self.isArrayBacked():
+            p = self.positions.astype(np.float64)
+            self.positions = p - p.mean(axis=0)
+            self._vertices = None
+            return
+
         massCenter = np.zeros(3)
         nVertices = len(self.vertices)
         for i in range(nVertices):
@@ -1,6 +1,4 @@
 import sys
-import os
-import importlib
 import matrices
 import numpy as np
 
@@ -10,11 +8,9 @@ from OpenGL.GLUT import *
 import argparse
 
 import filetypes
-handlers = {}
-for m in filetypes.__all__:
-    importlib.import_module('filetypes.'+m).register(handlers)
 
 import Mesh
+import meshcache
 global mesh
 mesh = None
 
@@ -163,15 +159,22 @@ if __name__ == '__main__':
     global args
     cameraMatrix = matrices.getIdentity4x4()
 
-    parser = argparse.ArgumentParser(description='Draw a 3D-model from *.ply file')
-    parser.add_argument('-model', help='Path to ply model file', default='icosahedron.ply')
+    parser = argparse.ArgumentParser(description='Draw a 3D-model from a ply, obj or stl file')
+    parser.add_argument('-model', help='Path to model file (ply, obj or stl)', default='icosahedron.ply')
     parser.add_argument('-f', '--faces', action='store_true', help='Draw faces', default=False)
     parser.add_argument('-e', '--edges', action='store_true', help='Draw edges', default=False)
     parser.add_argument('-s', '--silhouette', action='store_true', help='Draw silhouette', default=False)
     parser.add_argument('-t', '--lighting', action='store_true', help='Enable simple lighting', default=False)
+    parser.add_argument('-cache', help='Directory of parsed models', default=meshcache.defaultDirectory)
+    parser.add_argument('-cachesize', type=int, help='Size limit of the cache in MB', default=1024)
+    parser.add_argument('-nocache', action='store_true', help='Parse the model file every time', default=False)
     args = parser.parse_args()
 
-    mesh = handlers[os.path.splitext(args.model)[1][1:]](args.model)
+    loader = filetypes.loader(args.model)
+    if args.nocache:
+        mesh = loader(args.model)
+    else:
+        mesh = meshcache.MeshCache(args.cache, args.cachesize * 2 ** 20).load(args.model, loader)
     mesh.scale()
 
     # Basic initialization - the same for most apps
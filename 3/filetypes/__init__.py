@@ -1,6 +1,75 @@
 import os
+import struct
+import importlib
 
-__all__ = [os.path.splitext(os.path.basename(module))[0]
-	for module in os.listdir(os.path.dirname(__file__))
-	if os.path.splitext(module)[1] in ['.py', '.pyc', '.pyo']
-	if os.path.basename(module)[0] != '_']
+# Model formats by backend module: the file name extensions and a test of
+# the first bytes of a file. A backend is imported when a file of its format
+# is first loaded, formats are told apart by content before extension.
+
+SNIFF_BYTES = 512
+
+
+def _is_ply(head, size):
+	return head.startswith(b'ply\n') or head.startswith(b'ply\r\n')
+
+
+def _is_stl(head, size):
+	# binary STL: an 80 byte header, a triangle count and 50 bytes a
+	# triangle; ascii STL starts with solid, which binary ones may too
+	if size >= 84 and len(head) >= 84 and 84 + 50 * struct.unpack('<I', head[80:84])[0] == size:
+		return True
+	return head.lstrip().startswith(b'solid') and b'facet' in head
+
+
+def _is_obj(head, size):
+	# the last line read may be cut short
+	lines = head.splitlines()
+	if len(head) == SNIFF_BYTES:
+		lines = lines[:-1]
+	for line in lines:
+		line = line.strip()
+		if not line or line.startswith(b'#'):
+			continue
+		return line.split()[0] in (b'v', b'vn', b'vt', b'f', b'o', b'g', b's', b'mtllib', b'usemtl')
+	return False
+
+
+formats = [
+	('ply', ('ply',), _is_ply),
+	('stl', ('stl',), _is_stl),
+	('obj', ('obj',), _is_obj)
+]
+
+__all__ = [name for name, extensions, test in formats]
+
+_handlers = {}
+
+
+def identify(path):
+	"""Backend module name for path, by content and then by extension;
+	None for unknown formats."""
+	with open(path, 'rb') as f:
+		head = f.read(SNIFF_BYTES)
+	size = os.path.getsize(path)
+	for name, extensions, test in formats:
+		if test(head, size):
+			return name
+	ext = os.path.splitext(path)[1][1:].lower()
+	for name, extensions, test in formats:
+		if ext in extensions:
+			return name
+	return None
+
+
+def loader(path):
+	"""The parse function for path, importing its backend if needed."""
+	name = identify(path)
+	if name is None:
+		raise RuntimeError('{}: unknown model format'.format(path))
+	if name not in _handlers:
+		importlib.import_module('filetypes.' + name).register(_handlers)
+	return _handlers[name]
+
+
+def load(path):
+	return loader(path)(path)
@@ -0,0 +1,104 @@
+from Mesh import Mesh
+import re
+import warnings
+import numpy as np
+
+# Wavefront OBJ geometry: 'v' positions and 'f' faces, the rest (normals
+# and texture coordinates indexed per face corner, groups, materials) is
+# skipped. Lines are picked and parsed with array operations over the
+# bytes of the file, not one at a time.
+
+
+def parse_numbers(text):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ') if text.strip() else np.zeros(0)
+        except (ValueError, DeprecationWarning):
+            raise RuntimeError('OBJ: a field is not a number')
+
+
+def line_starts(data):
+    """Start and end (at the newline) of every line of data."""
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+    starts = np.concatenate([[0], newlines + 1])
+    ends = np.concatenate([newlines, [len(data)]])
+    keep = starts < ends
+    return starts[keep], ends[keep]
+
+
+def keyword_lines(data, starts, ends, keyword):
+    """Mask of the lines starting with keyword and a blank."""
+    b = np.frombuffer(data + b'\n' * (len(keyword) + 1), dtype=np.uint8)
+    mask = np.ones(len(starts), dtype=bool)
+    for i, c in enumerate(bytearray(keyword)):
+        mask &= b[starts + i] == c
+    following = b[starts + len(keyword)]
+    return mask & ((following == 32) | (following == 9))
+
+
+def select_lines(data, starts, ends, mask, keyword):
+    """The lines of mask without keyword, one per line, as bytes."""
+    buf = np.frombuffer(data, dtype=np.uint8).copy()
+    for i in range(len(keyword)):
+        buf[starts[mask] + i] = 32
+    # the bytes from the start of a line through its newline
+    marks = np.zeros(len(buf) + 2, dtype=np.int8)
+    marks[starts[mask]] = 1
+    marks[ends[mask] + 1] -= 1
+    keep = np.cumsum(marks[:len(buf)], dtype=np.int8).view(bool)
+    return buf[keep].tobytes() + b'\n'
+
+
+def token_counts(text, lines):
+    """Number of blank separated tokens on each of the lines of text."""
+    b = np.frombuffer(text, dtype=np.uint8)
+    blank = (b == 32) | (b == 9) | (b == 13) | (b == 10)
+    starts = ~blank
+    starts[1:] &= blank[:-1]
+    lineOf = np.searchsorted(np.flatnonzero(b == 10), np.flatnonzero(starts))
+    return np.bincount(lineOf, minlength=lines)[:lines]
+
+
+def parse_obj(fname):
+    with open(fname, 'rb') as f:
+        data = f.read()
+    starts, ends = line_starts(data)
+
+    isVertex = keyword_lines(data, starts, ends, b'v')
+    nVertices = int(isVertex.sum())
+    text = select_lines(data, starts, ends, isVertex, b'v')
+    values = parse_numbers(text)
+    counts = token_counts(text, nVertices)
+    if (counts < 3).any() or len(values) != counts.sum():
+        raise RuntimeError('OBJ: vertices need x, y and z')
+    # first three numbers of every line, some add w or a color
+    first = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    positions = values[first[:, None] + np.arange(3)] if nVertices else np.zeros((0, 3))
+
+    isFace = keyword_lines(data, starts, ends, b'f')
+    nFaces = int(isFace.sum())
+    # corners are v, v/vt, v//vn or v/vt/vn, only v is used
+    text = re.sub(b'/[^ \\t\\r\\n]*', b'', select_lines(data, starts, ends, isFace, b'f'))
+    indices = parse_numbers(text).astype(np.int64)
+    counts = token_counts(text, nFaces)
+    if len(indices) != counts.sum():
+        raise RuntimeError('OBJ: bad face')
+    if (counts < 3).any():
+        raise RuntimeError('OBJ: face with less than 3 vertices')
+
+    # indices start at 1, negative ones count back from the last vertex
+    # defined before the face
+    before = np.repeat((np.cumsum(isVertex))[isFace], counts)
+    indices = np.where(indices < 0, indices + before, indices - 1)
+    if len(indices) and (indices.min() < 0 or indices.max() >= nVertices):
+        raise RuntimeError('OBJ: face refers to a missing vertex')
+    offsets = np.zeros(nFaces + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    m = Mesh.fromArrays(positions, indices, offsets)
+    m.calculateNormals()
+    return m
+
+def register(handlers):
+    handlers['obj'] = parse_obj
@@ -1,147 +1,578 @@
-from Mesh import Mesh, Vertex, Face
+from Mesh import Mesh
+from collections import namedtuple
+import os
 import re
+import itertools
+import warnings
 import numpy as np
 
-def get_float(cstr):
-    return float(cstr)
+ply_dtypes = {
+      'char': 'i1',  'int8': 'i1',
+     'uchar': 'u1', 'uint8': 'u1',
+     'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+       'int': 'i4', 'int32': 'i4',
+      'uint': 'u4', 'uint32': 'u4',
+     'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8'
+}
 
+byte_orders = {'binary_little_endian': '<', 'binary_big_endian': '>'}
 
-def get_float32(cstr):
-    return np.float32(cstr)
+# format is 'ascii' or a key of byte_orders, elements a list of
+# (name, count, properties) where a property is (name, type) or
+# (name, 'list', count type, item type), size the byte length of the header
+# and comments the text of its comment lines
+Header = namedtuple('Header', 'format version elements size comments')
 
 
-def get_double(cstr):
-    return float(cstr)
+def read_header(f):
+    """Header of the ply file open in binary mode in f, which is left at the
+    start of the body."""
+    format_re = re.compile('format\\s+(?P<format>ascii|binary_little_endian|binary_big_endian)\\s+(?P<version>1.0)$')
+    comment_re = re.compile('(comment|obj_info)(\\s.*)?$')
+    element_re = re.compile('element\\s+(?P<name>\\w+)\\s+(?P<num>\\d+)')
+    property_re = re.compile('property\\s+(?P<type>\\w+)\\s+(?P<name>\\w+)')
+    property_list_re = re.compile('property\\s+list\\s+(?P<itype>\\w+)\\s+(?P<etype>\\w+)\\s+(?P<name>\\w+)')
 
+    if f.readline().rstrip() != b'ply':
+        raise RuntimeError('PLY: file is not a ply file')
+    match = format_re.match(f.readline().decode('ascii', 'replace').strip())
+    if not match:
+        raise RuntimeError('PLY: unsupported ply format')
+    fmt, version = match.group('format'), match.group('version')
+    element_types = []
+    comments = []
+    size = f.tell()
+    while True:
+        raw = f.readline()
+        if not raw:
+            raise RuntimeError('PLY: no end_header')
+        size += len(raw)
+        line = raw.decode('ascii', 'replace').strip()
+        if line == 'end_header':
+            return Header(fmt, version, element_types, size, comments)
+        if comment_re.match(line):
+            if line.startswith('comment'):
+                comments.append(line[len('comment'):].strip())
+            continue
+        match = element_re.match(line)
+        if match:
+            element_types.append((match.group('name'), int(match.group('num')), []))
+            continue
+        match = property_list_re.match(line)
+        if match and element_types:
+            element_types[-1][2].append((match.group('name'), 'list', match.group('itype'), match.group('etype')))
+            continue
+        match = property_re.match(line)
+        if match and element_types:
+            if match.group('type') not in ply_dtypes:
+                raise RuntimeError('PLY: unknown property type {}'.format(match.group('type')))
+            element_types[-1][2].append((match.group('name'), match.group('type')))
+            continue
+        raise RuntimeError('PLY: unknown header field')
 
-def get_char(cstr):
-    return int(cstr)
 
+def element_dtype(props, order='='):
+    """Structured dtype of one element row, None if it has list properties."""
+    if any(p[1] == 'list' for p in props):
+        return None
+    return np.dtype([(p[0], order + ply_dtypes[p[1]]) for p in props])
 
-def get_uchar(cstr):
-    return int(cstr)
 
+def read_binary_element(data, pos, count, props, order):
+    """Decode count rows of an element from the uint8 buffer data at byte
+    pos. Returns ({property: array}, end position); a list property is an
+    (offsets, items) pair, the items of row i being items[offsets[i]:offsets[i + 1]]."""
+    dtype = element_dtype(props, order)
+    if dtype is not None:
+        end = pos + count * dtype.itemsize
+        if end > len(data):
+            raise RuntimeError('PLY: file is truncated')
+        rows = np.frombuffer(data, dtype, count, pos)
+        return dict((p[0], rows[p[0]]) for p in props), end
 
-def get_short(cstr):
-    return int(cstr)
+    # rows of a single trailing list with the same length everywhere, as
+    # faces of a triangle or quad mesh are, make one structured array too
+    if count and props[-1][1] == 'list' and all(p[1] != 'list' for p in props[:-1]):
+        name, _, itype, etype = props[-1]
+        head = element_dtype(props[:-1], order)
+        if pos + head.itemsize + np.dtype(ply_dtypes[itype]).itemsize <= len(data):
+            k = int(np.frombuffer(data, order + ply_dtypes[itype], 1, pos + head.itemsize)[0])
+            dtype = np.dtype(head.descr + [('_count', order + ply_dtypes[itype]),
+                                           ('_items', order + ply_dtypes[etype], (k,))])
+            end = pos + count * dtype.itemsize
+            if end <= len(data):
+                rows = np.frombuffer(data, dtype, count, pos)
+                if (rows['_count'] == k).all():
+                    columns = dict((p[0], rows[p[0]]) for p in props[:-1])
+                    columns[name] = (np.arange(count + 1, dtype=np.int64) * k,
+                                     rows['_items'].reshape(-1))
+                    return columns, end
 
+    # mixed lengths: walk the rows
+    columns = dict((p[0], []) for p in props)
+    for _ in range(count):
+        for p in props:
+            if p[1] == 'list':
+                n = np.frombuffer(data, order + ply_dtypes[p[2]], 1, pos)[0]
+                pos += np.dtype(ply_dtypes[p[2]]).itemsize
+                items = np.frombuffer(data, order + ply_dtypes[p[3]], n, pos)
+                pos += items.nbytes
+                columns[p[0]].append(items)
+            else:
+                dt = np.dtype(order + ply_dtypes[p[1]])
+                columns[p[0]].append(np.frombuffer(data, dt, 1, pos)[0])
+                pos += dt.itemsize
+    for p in props:
+        if p[1] == 'list':
+            lists = columns[p[0]]
+            offsets = np.zeros(count + 1, dtype=np.int64)
+            np.cumsum([len(l) for l in lists], out=offsets[1:])
+            columns[p[0]] = (offsets, np.concatenate(lists) if lists else
+                             np.zeros(0, ply_dtypes[p[3]]))
+        else:
+            columns[p[0]] = np.array(columns[p[0]], dtype=ply_dtypes[p[1]])
+    return columns, pos
 
-def get_ushort(cstr):
-    return int(cstr)
 
+def read_binary_elements(fname, header):
+    """{element name: columns} of a binary ply file, see read_binary_element.
+    The body is memory mapped, fixed size columns are views into it."""
+    order = byte_orders[header.format]
+    if os.path.getsize(fname) > header.size:
+        data = np.memmap(fname, dtype=np.uint8, mode='r', offset=header.size)
+    else:
+        data = np.zeros(0, dtype=np.uint8)
+    elements = {}
+    pos = 0
+    for name, count, props in header.elements:
+        elements[name], pos = read_binary_element(data, pos, count, props, order)
+    return elements
 
-def get_int(cstr):
-    return int(cstr)
 
-def get_uint(cstr):
-    return int(cstr)
+def ascii_dtype(ptype):
+    # text floats are kept as doubles unless declared float32
+    code = ply_dtypes[ptype]
+    return 'f8' if code == 'f4' and ptype != 'float32' else code
 
 
-def get_uint8(cstr):
-    return np.uint8(cstr)
+def read_ascii_element(tokens, pos, count, props):
+    """Like read_binary_element for the numbers of an ascii body, parsed
+    into the float64 array tokens, starting at index pos."""
+    if all(p[1] != 'list' for p in props):
+        width = len(props)
+        end = pos + count * width
+        if end > len(tokens):
+            raise RuntimeError('PLY: file is truncated')
+        rows = tokens[pos:end].reshape(count, width)
+        return dict((p[0], rows[:, i].astype(ascii_dtype(p[1])))
+                    for i, p in enumerate(props)), end
 
+    # a single trailing list of the same length in every row
+    if count and props[-1][1] == 'list' and all(p[1] != 'list' for p in props[:-1]):
+        name, _, itype, etype = props[-1]
+        width = len(props) - 1
+        if pos + width < len(tokens):
+            k = int(tokens[pos + width])
+            end = pos + count * (width + 1 + k)
+            if k >= 0 and end <= len(tokens):
+                rows = tokens[pos:end].reshape(count, width + 1 + k)
+                if (rows[:, width] == k).all():
+                    columns = dict((p[0], rows[:, i].astype(ascii_dtype(p[1])))
+                                   for i, p in enumerate(props[:-1]))
+                    columns[name] = (np.arange(count + 1, dtype=np.int64) * k,
+                                     rows[:, width + 1:].astype(ascii_dtype(etype)).reshape(-1))
+                    return columns, end
 
-def parse_ply(fname):
-    m = Mesh()
-    state = 'init'
-    format_re = re.compile('format\\s+ascii\\s+1.0')
-    comment_re = re.compile('comment\\s.*')
-    element_re = re.compile('element\\s+(?P<name>\\w+)\\s+(?P<num>\\d+)')
-    property_re = re.compile('property\\s+(?P<type>\\w+)\\s+(?P<name>\\w+)')
-    property_list_re = re.compile('property\\s+list\\s+(?P<itype>\\w+)\\s+(?P<etype>\\w+)\\s+(?P<name>\\w+)')
-    element_types = []
-    vertex_names = {
-        'x': lambda v, x: v.setX(x),
-        'y': lambda v, y: v.setY(y),
-        'z': lambda v, z: v.setZ(z),
-        'nx': lambda v, nx: v.setNX(nx),
-        'ny': lambda v, ny: v.setNY(ny),
-        'nz': lambda v, nz: v.setNZ(nz),
-        's': lambda v, s: v.setS(s),
-        't': lambda v, t: v.setT(t)
-    }
-    face_names = {
-        #'vertex_indices': (lambda f, l, m=m: f.set([m.getVertex(v) for v in l])) #real values of vertices
-        'vertex_indices': (lambda f, l, m=m: f.set(l))                            #references to vertices
-    }
-    element_type_dict = {
-        'vertex' : (lambda: Vertex(), vertex_names, lambda v, m=m: m.addVertex(v)),
-        'face' : (lambda: Face(), face_names, lambda f, m=m: m.addFace(f))
-    }
-    type_handles = {
-         'float': get_float,
-        'float32': get_float32,
-        'double': get_double,
-          'char': get_char,
-         'uchar': get_uchar,
-         'short': get_short,
-        'ushort': get_ushort,
-           'int': get_int,
-         'int32': get_int,
-          'uint': get_uint,
-         'uint8': get_uint8
-    }
-    i = j = 0
-    for line in open(fname, 'r'):
-        line = line.rstrip()
-        if state == 'init':
-            if line != 'ply':
-                raise RuntimeError('PLY: file is not a ply file')
-            state = 'format'
-        elif state == 'format':
-            if not format_re.match(line):
-                raise RuntimeError('PLY: unsupported ply format')
-            state = 'header'
-        elif state == 'header':
-            if comment_re.match(line):
-                #comment, do nothing
-                continue
-            match = element_re.match(line)
-            if match:
-                element_types.append((match.group('name'), int(match.group('num')), []))
-                continue
-            match = property_list_re.match(line)
-            if match:
-                element_types[-1][2].append((match.group('name'), 'list', match.group('itype'), match.group('etype')))
-                continue
-            match = property_re.match(line)
-            if match:
-                element_types[-1][2].append((match.group('name'), match.group('type')))
-                continue
-            if line == 'end_header':
-                state = 'body'
-                continue
-            raise RuntimeError('PLY: unknown header field')
-        elif state == 'body':
-            if j >= element_types[i][1]:
-                j = 0
-                i = i + 1
-
-            if i >= len(element_types):
-                raise RuntimeExeception('PLY: too much data in file')
-
-            line = line.split()
-            actions = element_type_dict[element_types[i][0]]
-            obj = actions[0]()
-
-            for propty in element_types[i][2]:
-                x = None
-                if propty[1] == 'list':
-                    numelems = type_handles[propty[2]](line[0])
-                    line = line[1:]
-                    x = []
-                    for count in range(numelems):
-                        x.append(type_handles[propty[3]](line[0]))
-                        line = line[1:]
+    # mixed lengths: walk the rows
+    columns = dict((p[0], []) for p in props)
+    try:
+        for _ in range(count):
+            for p in props:
+                if p[1] == 'list':
+                    n = int(tokens[pos])
+                    columns[p[0]].append(tokens[pos + 1:pos + 1 + n])
+                    if len(columns[p[0]][-1]) != n:
+                        raise IndexError()
+                    pos += 1 + n
                 else:
-                    x = type_handles[propty[1]](line[0])
-                    line = line[1:]
-                actions[1][propty[0]](obj, x)
-            actions[2](obj)
-            j = j + 1
+                    columns[p[0]].append(tokens[pos])
+                    pos += 1
+    except IndexError:
+        raise RuntimeError('PLY: file is truncated')
+    for p in props:
+        if p[1] == 'list':
+            lists = columns[p[0]]
+            offsets = np.zeros(count + 1, dtype=np.int64)
+            np.cumsum([len(l) for l in lists], out=offsets[1:])
+            items = np.concatenate(lists) if lists else np.zeros(0)
+            columns[p[0]] = (offsets, items.astype(ascii_dtype(p[3])))
+        else:
+            columns[p[0]] = np.array(columns[p[0]]).astype(ascii_dtype(p[1]))
+    return columns, pos
+
+
+def parse_numbers(text):
+    """float64 array of the whitespace separated numbers in text."""
+    with warnings.catch_warnings():
+        # numpy warns rather than fails on text that is not a number
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ')
+        except (ValueError, DeprecationWarning):
+            raise RuntimeError('PLY: body has a field that is not a number')
+
+
+def read_ascii_elements(f, header):
+    """{element name: columns} of the ascii body that follows the header in
+    the binary mode file f, see read_ascii_element."""
+    tokens = parse_numbers(f.read())
+    elements = {}
+    pos = 0
+    for name, count, props in header.elements:
+        elements[name], pos = read_ascii_element(tokens, pos, count, props)
+    if pos != len(tokens):
+        raise RuntimeError('PLY: too much data in file')
+    return elements
+
+
+def iter_ply(fname, batch_size=65536):
+    """Read fname a piece at a time: yields the Header, then
+    (element name, index of the first row, columns) for batches of at most
+    batch_size rows in file order. columns are as read_binary_element
+    returns them, list offsets starting at 0 in every batch. Only the
+    current batch is in memory; ascii bodies must have one row per line."""
+    with open(fname, 'rb') as f:
+        header = read_header(f)
+        yield header
+        for name, count, props in header.elements:
+            start = 0
+            for columns, rows in read_batches(f, header.format, count, props, batch_size):
+                yield name, start, columns
+                start += rows
+
+
+def read_batches(f, fmt, count, props, batch_size):
+    """Yield (columns, rows) for count rows with properties props of a
+    fmt body, read from the current position of f in batches of at most
+    batch_size rows."""
+    if fmt == 'ascii':
+        return _ascii_batches(f, count, props, batch_size)
+    return _binary_batches(f, count, props, byte_orders[fmt], batch_size)
+
+
+def _ascii_batches(f, count, props, batch_size):
+    done = 0
+    while done < count:
+        n = min(batch_size, count - done)
+        lines = list(itertools.islice(f, n))
+        if len(lines) < n:
+            raise RuntimeError('PLY: file is truncated')
+        tokens = parse_numbers(b''.join(lines))
+        columns, pos = read_ascii_element(tokens, 0, n, props)
+        if pos != len(tokens):
+            raise RuntimeError('PLY: rows of an ascii body must be one per line')
+        done += n
+        yield columns, n
+
+
+def _read_rows(f, dtype, count):
+    # up to count whole rows from the current position of f
+    if not dtype.itemsize:
+        return np.zeros(count, dtype)
+    data = f.read(count * dtype.itemsize)
+    return np.frombuffer(data, dtype, len(data) // dtype.itemsize)
+
+
+def _binary_batches(f, count, props, order, batch_size):
+    dtype = element_dtype(props, order)
+    done = 0
+    while done < count:
+        n = min(batch_size, count - done)
+        if dtype is not None:
+            rows = _read_rows(f, dtype, n)
+            if len(rows) < n:
+                raise RuntimeError('PLY: file is truncated')
+            columns = dict((p[0], rows[p[0]]) for p in props)
+        elif props[-1][1] == 'list' and all(p[1] != 'list' for p in props[:-1]):
+            columns = _read_list_runs(f, n, props, order)
+        else:
+            columns = _read_rows_walking(f, n, props, order)
+        done += n
+        yield columns, n
+
+
+def _read_list_runs(f, n, props, order):
+    # n rows ending in a list, read as runs of rows with equal list length
+    name, _, itype, etype = props[-1]
+    head = element_dtype(props[:-1], order)
+    countType = np.dtype(order + ply_dtypes[itype])
+    runs = []
+    got = 0
+    while got < n:
+        pos = f.tell()
+        f.seek(head.itemsize, 1)
+        k = np.frombuffer(f.read(countType.itemsize), countType)
+        if not len(k):
+            raise RuntimeError('PLY: file is truncated')
+        f.seek(pos)
+        dtype = np.dtype(head.descr + [('_count', countType),
+                                       ('_items', order + ply_dtypes[etype], (int(k[0]),))])
+        rows = _read_rows(f, dtype, n - got)
+        other = np.flatnonzero(rows['_count'] != k[0])
+        if len(other):
+            rows = rows[:other[0]]
+        if not len(rows):
+            raise RuntimeError('PLY: file is truncated')
+        f.seek(pos + len(rows) * dtype.itemsize)
+        runs.append(rows)
+        got += len(rows)
+
+    columns = dict((p[0], np.concatenate([r[p[0]] for r in runs])) for p in props[:-1])
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.concatenate([r['_count'] for r in runs]), out=offsets[1:])
+    columns[name] = (offsets, np.concatenate([r['_items'].reshape(-1) for r in runs]))
+    return columns
+
+
+def _read_rows_walking(f, n, props, order):
+    # n rows of any layout, a property at a time
+    columns = dict((p[0], []) for p in props)
+    for _ in range(n):
+        for p in props:
+            if p[1] == 'list':
+                count = _read_rows(f, np.dtype(order + ply_dtypes[p[2]]), 1)
+                items = _read_rows(f, np.dtype(order + ply_dtypes[p[3]]), int(count[0])) \
+                    if len(count) else None
+                if items is None or len(items) < count[0]:
+                    raise RuntimeError('PLY: file is truncated')
+                columns[p[0]].append(items)
+            else:
+                value = _read_rows(f, np.dtype(order + ply_dtypes[p[1]]), 1)
+                if not len(value):
+                    raise RuntimeError('PLY: file is truncated')
+                columns[p[0]].append(value)
+    for p in props:
+        if p[1] == 'list':
+            lists = columns[p[0]]
+            offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum([len(l) for l in lists], out=offsets[1:])
+            columns[p[0]] = (offsets, np.concatenate(lists))
+        else:
+            columns[p[0]] = np.concatenate(columns[p[0]])
+    return columns
+
+
+def _stack(columns, names):
+    # (n, len(names)) native-endian array of the named columns, None if any
+    # of them is missing
+    if not all(name in columns for name in names):
+        return None
+    a = np.column_stack([columns[name] for name in names])
+    return a.astype(a.dtype.newbyteorder('='), copy=False)
 
+
+def mesh_from_elements(elements):
+    """Array backed Mesh from decoded 'vertex' and 'face' elements."""
+    vertex = elements.get('vertex', {})
+    positions = _stack(vertex, 'xyz')
+    if positions is None:
+        raise RuntimeError('PLY: vertices need x, y and z')
+    face = elements.get('face', {})
+    faceList = face.get('vertex_indices', face.get('vertex_index'))
+    if faceList is None:
+        faceList = (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    offsets, indices = faceList
+    return Mesh.fromArrays(positions, indices.astype(np.int64), offsets,
+                           normals=_stack(vertex, ('nx', 'ny', 'nz')),
+                           texCoords=_stack(vertex, 'st'))
+
+
+def read_elements(fname):
+    """(Header, {element name: columns}) of a whole ply file."""
+    with open(fname, 'rb') as f:
+        header = read_header(f)
+        if header.format == 'ascii':
+            return header, read_ascii_elements(f, header)
+    return header, read_binary_elements(fname, header)
+
+
+def parse_ply(fname):
+    header, elements = read_elements(fname)
+    m = mesh_from_elements(elements)
     m.calculateNormals()
     return m
 
+# float32 rather than float, which ascii bodies read as double
+type_names = {'i1': 'char', 'u1': 'uchar', 'i2': 'short', 'u2': 'ushort',
+              'i4': 'int', 'u4': 'uint', 'f4': 'float32', 'f8': 'double'}
+
+
+def ply_type(dtype):
+    """PLY type name of a NumPy dtype, 64-bit integers become int."""
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu' and dtype.itemsize == 8:
+        return 'int'
+    return type_names[dtype.kind + str(dtype.itemsize)]
+
+
+def header_text(fmt, element_types, comments=()):
+    lines = ['ply', 'format {} 1.0'.format(fmt)]
+    lines += ['comment ' + c for c in comments]
+    for name, count, props in element_types:
+        lines.append('element {} {}'.format(name, count))
+        for p in props:
+            if p[1] == 'list':
+                lines.append('property list {} {} {}'.format(p[2], p[3], p[0]))
+            else:
+                lines.append('property {} {}'.format(p[1], p[0]))
+    lines.append('end_header')
+    return '\n'.join(lines) + '\n'
+
+
+def write_elements(fname, fmt, element_types, elements, comments=()):
+    """Write a ply file in format fmt ('ascii' or a key of byte_orders) with
+    the elements (name, count, properties) of element_types, their data
+    given as columns like read_elements returns them."""
+    with open(fname, 'wb') as f:
+        f.write(header_text(fmt, element_types, comments).encode('ascii'))
+        for name, count, props in element_types:
+            if not count:
+                continue
+            if fmt == 'ascii':
+                _write_ascii_element(f, count, props, elements[name])
+            else:
+                _write_binary_element(f, count, props, elements[name], byte_orders[fmt])
+
+
+def _list_runs(offsets):
+    # (first row, end row, length) of the runs of lists with one length
+    counts = np.diff(offsets)
+    bounds = np.flatnonzero(np.diff(counts)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(counts)]])
+    return zip(starts.tolist(), ends.tolist(), counts[starts].tolist())
+
+
+def _write_binary_element(f, count, props, columns, order):
+    dtype = element_dtype(props, order)
+    if dtype is not None:
+        rows = np.empty(count, dtype)
+        for p in props:
+            rows[p[0]] = columns[p[0]]
+        f.write(rows.tobytes())
+        return
+
+    if props[-1][1] == 'list' and all(p[1] != 'list' for p in props[:-1]):
+        name, _, itype, etype = props[-1]
+        head = element_dtype(props[:-1], order)
+        offsets, items = columns[name]
+        for a, b, k in _list_runs(offsets):
+            rows = np.empty(b - a, head.descr + [('_count', order + ply_dtypes[itype]),
+                                                 ('_items', order + ply_dtypes[etype], (k,))])
+            for p in props[:-1]:
+                rows[p[0]] = columns[p[0]][a:b]
+            rows['_count'] = k
+            rows['_items'] = np.asarray(items[offsets[a]:offsets[b]]).reshape(b - a, k)
+            f.write(rows.tobytes())
+        return
+
+    for i in range(count):
+        for p in props:
+            if p[1] == 'list':
+                offsets, items = columns[p[0]]
+                row = items[offsets[i]:offsets[i + 1]]
+                f.write(np.array(len(row), order + ply_dtypes[p[2]]).tobytes())
+                f.write(np.asarray(row, order + ply_dtypes[p[3]]).tobytes())
+            else:
+                f.write(np.array(columns[p[0]][i], order + ply_dtypes[p[1]]).tobytes())
+
+
+def _ascii_format(ptype):
+    # floats as short as reads back the same value
+    code = ply_dtypes[ptype]
+    if code[0] in 'iu':
+        return '%d'
+    return '%.9g' if code == 'f4' else '%r'
+
+
+def _values(columns):
+    # row-major tuple of python values of equally long columns
+    return tuple(itertools.chain.from_iterable(zip(*[np.asarray(c).tolist() for c in columns])))
+
+
+def _write_ascii_element(f, count, props, columns):
+    # one % formatting per block of rows instead of per row
+    if all(p[1] != 'list' for p in props):
+        line = ' '.join(_ascii_format(p[1]) for p in props) + '\n'
+        f.write(((line * count) % _values([columns[p[0]] for p in props])).encode('ascii'))
+        return
+
+    if props[-1][1] == 'list' and all(p[1] != 'list' for p in props[:-1]):
+        name, _, itype, etype = props[-1]
+        offsets, items = columns[name]
+        for a, b, k in _list_runs(offsets):
+            block = np.asarray(items[offsets[a]:offsets[b]]).reshape(b - a, k)
+            line = ' '.join([_ascii_format(p[1]) for p in props[:-1]] +
+                            ['%d'] + [_ascii_format(etype)] * k) + '\n'
+            values = _values([columns[p[0]][a:b] for p in props[:-1]] +
+                             [np.full(b - a, k)] + [block[:, j] for j in range(k)])
+            f.write(((line * (b - a)) % values).encode('ascii'))
+        return
+
+    for i in range(count):
+        fields = []
+        for p in props:
+            if p[1] == 'list':
+                offsets, items = columns[p[0]]
+                row = np.asarray(items[offsets[i]:offsets[i + 1]]).tolist()
+                fields.append('%d' % len(row))
+                fields += [_ascii_format(p[3]) % v for v in row]
+            else:
+                fields.append(_ascii_format(p[1]) % np.asarray(columns[p[0]][i]).tolist())
+        f.write((' '.join(fields) + '\n').encode('ascii'))
+
+
+def mesh_elements(mesh):
+    """(element types, columns) of the vertices and faces of a Mesh."""
+    if mesh.isArrayBacked():
+        positions, normals, st = mesh.positions, mesh.fileNormals, mesh.texCoords
+        offsets, indices = mesh.faceOffsets, mesh.faceIndices
+    else:
+        vertices = mesh.vertices
+        positions = np.array([v.coords() for v in vertices], dtype=np.float64).reshape(-1, 3)
+        # normals of an object mesh include the computed ones, only
+        # coordinates and texture coordinates are its own
+        normals = None
+        st = None
+        if vertices and all(v.hasST() for v in vertices):
+            st = np.array([v.stcoords() for v in vertices], dtype=np.float64)
+        faces = [list(face.vertices()) for face in mesh.faces]
+        offsets = np.zeros(len(faces) + 1, dtype=np.int64)
+        np.cumsum([len(face) for face in faces], out=offsets[1:])
+        indices = np.array(list(itertools.chain.from_iterable(faces)), dtype=np.int64)
+
+    vertex = [(c, ply_type(positions.dtype)) for c in 'xyz']
+    columns = dict(zip('xyz', np.asarray(positions).T))
+    if normals is not None:
+        vertex += [(c, ply_type(normals.dtype)) for c in ('nx', 'ny', 'nz')]
+        columns.update(zip(('nx', 'ny', 'nz'), np.asarray(normals).T))
+    if st is not None:
+        vertex += [(c, ply_type(st.dtype)) for c in 'st']
+        columns.update(zip('st', np.asarray(st).T))
+    counts = np.diff(offsets)
+    countType = 'uchar' if not len(counts) or counts.max() < 256 else 'int'
+    face = [('vertex_indices', 'list', countType, 'int')]
+    element_types = [('vertex', len(positions), vertex), ('face', len(counts), face)]
+    return element_types, {'vertex': columns, 'face': {'vertex_indices': (offsets, indices)}}
+
+
+def write_ply(fname, mesh, fmt='binary_little_endian', comments=()):
+    """Write the vertices and faces of mesh to fname as a ply file."""
+    element_types, elements = mesh_elements(mesh)
+    write_elements(fname, fmt, element_types, elements, comments)
+
+
 def register(handlers):
     handlers['ply'] = parse_ply
\ No newline at end of file
@@ -0,0 +1,76 @@
+from Mesh import Mesh
+import os
+import re
+import struct
+import numpy as np
+
+# a binary STL triangle: facet normal, three corners, attribute byte count
+triangle_dtype = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)),
+                           ('attributes', '<u2')])
+
+
+def weld(corners):
+    """(positions, faces) of (n, 3, 3) triangle corners, with equal corners
+    merged into one vertex; vertices are numbered in order of appearance."""
+    # adding zero turns -0.0 into 0.0, which would not compare equal bitwise
+    points = np.ascontiguousarray(corners, dtype=np.float32).reshape(-1, 3) + np.float32(0)
+    if not len(points):
+        return points, np.zeros((0, 3), dtype=np.int64)
+    bits = points.view(np.uint32)
+    # sort by z, then stably by x and y packed in one key: equal corners end
+    # up next to each other, the first one in the file leading
+    xy = (bits[:, 0].astype(np.uint64) << np.uint64(32)) | bits[:, 1]
+    order = np.argsort(bits[:, 2], kind='stable')
+    order = order[np.argsort(xy[order], kind='stable')]
+    run = bits[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (run[1:] != run[:-1]).any(axis=1)
+    first = order[new]
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    faces = np.empty(len(order), dtype=np.int64)
+    faces[order] = rank[np.cumsum(new) - 1]
+    return points[np.sort(first)], faces.reshape(-1, 3)
+
+
+def read_binary_stl(fname):
+    """(n, 3, 3) corners of the triangles of a binary STL file."""
+    with open(fname, 'rb') as f:
+        data = f.read()
+    if len(data) < 84:
+        raise RuntimeError('STL: file is truncated')
+    count = struct.unpack('<I', data[80:84])[0]
+    if len(data) < 84 + count * triangle_dtype.itemsize:
+        raise RuntimeError('STL: file is truncated')
+    return np.frombuffer(data, triangle_dtype, count, 84)['corners']
+
+
+def read_ascii_stl(fname):
+    with open(fname, 'rb') as f:
+        data = f.read()
+    text = b' '.join(re.findall(b'vertex\\s+([^\\n]*)', data))
+    corners = np.fromstring(text, sep=' ') if text else np.zeros(0)
+    if len(corners) % 9:
+        raise RuntimeError('STL: facets need three vertices of three coordinates')
+    return corners.reshape(-1, 3, 3)
+
+
+def is_binary(fname):
+    # binary files may start with solid too, their size tells them apart
+    with open(fname, 'rb') as f:
+        head = f.read(84)
+    if len(head) == 84 and (84 + triangle_dtype.itemsize * struct.unpack('<I', head[80:84])[0] ==
+                            os.path.getsize(fname)):
+        return True
+    return not head.lstrip().startswith(b'solid')
+
+
+def parse_stl(fname):
+    corners = read_binary_stl(fname) if is_binary(fname) else read_ascii_stl(fname)
+    positions, faces = weld(corners)
+    m = Mesh.fromArrays(positions, faces)
+    m.calculateNormals()
+    return m
+
+def register(handlers):
+    handlers['stl'] = parse_stl
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+from Mesh import Mesh, arrayNames
+
+# Parsed meshes with their normals and edge tables, kept as .npy files that
+# warm loads memory map instead of parsing. An entry is a directory named by
+# the SHA-1 of the model file and formatVersion; index.json maps a model
+# path, size and mtime to it, so an unchanged file is found without reading it.
+
+defaultDirectory = os.path.join(os.path.expanduser('~'), '.cache', 'plydraw')
+defaultMaxBytes = 1024 * 2 ** 20
+# bump when the stored arrays change: normals, edge tables or what the
+# loaders produce; entries of other versions are never read and age out
+formatVersion = 1
+
+
+def fileHash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MeshCache(object):
+    def __init__(self, directory=defaultDirectory, maxBytes=defaultMaxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.indexPath = os.path.join(directory, 'index.json')
+        # a lowered maxBytes applies to a cache that is only read too
+        self.evict()
+
+    def load(self, path, loader):
+        """Mesh of path, from the cache if it holds the file's contents,
+        else from loader(path), which is then stored."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        index = self._readIndex()
+        known = index.get(path)
+        if (known and known['size'] == st.st_size and known['mtime'] == st.st_mtime
+                and known.get('version') == formatVersion):
+            key = known['hash']
+        else:
+            key = '{}-v{}'.format(fileHash(path), formatVersion)
+
+        mesh = self._read(key)
+        if mesh is None:
+            mesh = loader(path)
+            if not mesh.isArrayBacked():
+                return mesh
+            if mesh.faceNormals is None:
+                mesh.calculateNormals()
+            if mesh.edgeArray is None:
+                mesh.calculateEdges()
+            self._write(key, mesh)
+        if known is None or known['hash'] != key or known['mtime'] != st.st_mtime:
+            index = self._readIndex()
+            index[path] = {'size': st.st_size, 'mtime': st.st_mtime, 'hash': key,
+                           'version': formatVersion}
+            self._writeIndex(index)
+        return mesh
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def _read(self, key):
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return None
+        arrays = {}
+        try:
+            for name in os.listdir(entry):
+                if name.endswith('.npy') and name[:-4] in arrayNames:
+                    arrays[name[:-4]] = np.load(os.path.join(entry, name), mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            # removed by another process's eviction, or a damaged file
+            return None
+        if 'positions' not in arrays:
+            return None
+        # the entry mtime is its last use for eviction
+        os.utime(entry, None)
+        return Mesh.fromArrayDict(arrays)
+
+    def _write(self, key, mesh):
+        if sum(a.nbytes for a in mesh.arrays().values()) > self.maxBytes:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # written aside and renamed, readers never see half an entry
+        tmp = tempfile.mkdtemp(prefix='.' + key, dir=self.directory)
+        for name, a in mesh.arrays().items():
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(a))
+        try:
+            os.rename(tmp, self._entry(key))
+        except OSError:
+            # stored meanwhile by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    def entries(self):
+        """(last use, bytes, key) of every entry, oldest first."""
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for key in os.listdir(self.directory):
+            entry = self._entry(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name))
+                           for name in os.listdir(entry))
+                result.append((os.path.getmtime(entry), size, key))
+            except OSError:
+                # removed by another process's eviction
+                continue
+        return sorted(result)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache holds at
+        most maxBytes, never the entry keep."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = set()
+        for _, size, key in entries:
+            if total <= self.maxBytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            removed.add(key)
+            total -= size
+        if removed:
+            index = self._readIndex()
+            self._writeIndex(dict((p, v) for p, v in index.items() if v['hash'] not in removed))
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+        if os.path.exists(self.indexPath):
+            os.remove(self.indexPath)
+
+    def _readIndex(self):
+        try:
+            with open(self.indexPath) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _writeIndex(self, index):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        tmp = '{}.{}.{}'.format(self.indexPath, os.getpid(), int(time.time() * 1000))
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.rename(tmp, self.indexPath)
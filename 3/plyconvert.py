@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+from filetypes import ply
+
+# Rewrites ply files in another encoding, binary_little_endian by default,
+# keeping every element, property type and comment. Directories are
+# converted recursively into the same layout under the output directory.
+
+
+def conversion_jobs(sources, output):
+    """(source, destination) pairs of the ply files among sources."""
+    jobs = []
+    for src in sources:
+        if os.path.isdir(src):
+            for root, dirs, files in os.walk(src):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.ply'):
+                        path = os.path.join(root, name)
+                        jobs.append((path, os.path.join(output, os.path.relpath(path, src))))
+        else:
+            jobs.append((src, os.path.join(output, os.path.basename(src))))
+    return jobs
+
+
+def convert(job):
+    """Convert one file; returns (source, seconds, error message or None)."""
+    src, dst, fmt = job
+    start = time.time()
+    tmp = dst + '.part'
+    try:
+        header, elements = ply.read_elements(src)
+        ply.write_elements(tmp, fmt, header.elements, elements, header.comments)
+        os.rename(tmp, dst)
+    except (RuntimeError, IOError, OSError) as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return src, time.time() - start, str(e)
+    return src, time.time() - start, None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert ply files between ascii and binary encodings')
+    parser.add_argument('sources', nargs='+', help='ply files or directories of them')
+    parser.add_argument('-o', '--output', required=True, help='Output directory')
+    parser.add_argument('--format', choices=['binary_little_endian', 'binary_big_endian', 'ascii'],
+                        default='binary_little_endian', help='Encoding to write')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='Files converted at a time')
+    args = parser.parse_args()
+
+    jobs = conversion_jobs(args.sources, args.output)
+    for src, dst in jobs:
+        if os.path.abspath(src) == os.path.abspath(dst):
+            parser.error('{} would be overwritten, choose another output directory'.format(src))
+        if not os.path.isdir(os.path.dirname(dst) or '.'):
+            os.makedirs(os.path.dirname(dst))
+    jobs = [(src, dst, args.format) for src, dst in jobs]
+
+    start = time.time()
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        results = pool.imap_unordered(convert, jobs)
+    else:
+        pool = None
+        results = (convert(job) for job in jobs)
+
+    failed = 0
+    for src, secs, error in results:
+        if error:
+            failed += 1
+            print('{}: {}'.format(src, error), file=sys.stderr)
+        else:
+            print('{} {:.3f}s'.format(src, secs))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    print('{} files in {:.2f}s, {} failed'.format(len(jobs), time.time() - start, failed))
+
+    exit(1 if failed else 0)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+from filetypes import ply
+
+# Inspection of ply files without parsing their bodies. An index holds the
+# header, the byte range of every element block and the bounding box of
+# binary files, taken from the x, y and z columns alone. Rows of one size
+# are found by arithmetic, rows of varying size (mixed polygons, ascii
+# lines) through the recorded start of every step-th row. The index is
+# saved next to the file as <file>.plyidx, so reading a range of rows later
+# is a seek.
+
+STEP = 4096
+CHUNK_ROWS = 2 ** 20
+CHUNK_BYTES = 2 ** 24
+
+
+def index_path(fname):
+    return fname + '.plyidx'
+
+
+def build_index(fname, step=STEP):
+    st = os.stat(fname)
+    with open(fname, 'rb') as f:
+        header = ply.read_header(f)
+    if header.format == 'ascii':
+        elements = _ascii_offsets(fname, header, step)
+    else:
+        elements = _binary_offsets(fname, header, step)
+    index = {'size': st.st_size, 'mtime': st.st_mtime, 'format': header.format,
+             'version': header.version, 'comments': header.comments,
+             'header_size': header.size, 'step': step, 'elements': elements,
+             'bbox': None}
+    if header.format != 'ascii':
+        index['bbox'] = _binary_bbox(fname, header.format, elements)
+    return index
+
+
+def load_index(fname):
+    """The saved index of fname, None if there is none or the file changed."""
+    try:
+        with open(index_path(fname)) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    st = os.stat(fname)
+    if index.get('size') != st.st_size or index.get('mtime') != st.st_mtime:
+        return None
+    return index
+
+
+def save_index(fname, index):
+    """Write the index next to fname; False if the directory is read-only."""
+    tmp = '{}.{}'.format(index_path(fname), os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.rename(tmp, index_path(fname))
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def inspect(fname, step=STEP, save=True):
+    """Index of fname: the saved one if current, else a new one, saved
+    unless save is False."""
+    index = load_index(fname)
+    if index is None:
+        index = build_index(fname, step)
+        if save:
+            save_index(fname, index)
+    return index
+
+
+def element_entry(index, name):
+    for entry in index['elements']:
+        if entry['name'] == name:
+            return entry
+    raise ValueError('no element {}'.format(name))
+
+
+def read_rows(fname, name, start, stop, index=None):
+    """Columns of rows start to stop (exclusive) of element name, as
+    ply.read_elements returns them, read after a seek through the index."""
+    index = index or inspect(fname)
+    entry = element_entry(index, name)
+    stop = min(stop, entry['count'])
+    if not 0 <= start <= stop:
+        raise ValueError('rows {} to {} of {} {}'.format(start, stop, entry['count'], name))
+    props = [tuple(p) for p in entry['properties']]
+
+    with open(fname, 'rb') as f:
+        if entry['row_size'] is not None:
+            first = start
+            f.seek(entry['offset'] + start * entry['row_size'])
+        else:
+            first = start // index['step'] * index['step']
+            f.seek(entry['checkpoints'][start // index['step']] if first < entry['count']
+                   else entry['end'])
+        columns = None
+        for columns, rows in ply.read_batches(f, index['format'], stop - first, props, stop - first):
+            pass
+    if columns is None:
+        return _empty_columns(props)
+    return _skip_rows(columns, start - first)
+
+
+def _empty_columns(props):
+    columns = {}
+    for p in props:
+        if p[1] == 'list':
+            columns[p[0]] = (np.zeros(1, dtype=np.int64), np.zeros(0, ply.ply_dtypes[p[3]]))
+        else:
+            columns[p[0]] = np.zeros(0, ply.ply_dtypes[p[1]])
+    return columns
+
+
+def _skip_rows(columns, skip):
+    if not skip:
+        return columns
+    result = {}
+    for key, c in columns.items():
+        if isinstance(c, tuple):
+            offsets, items = c
+            result[key] = (offsets[skip:] - offsets[skip], items[offsets[skip]:])
+        else:
+            result[key] = c[skip:]
+    return result
+
+
+def _checkpoint_rows(row, n, step):
+    # rows among row .. row + n - 1 that are multiples of step
+    return np.arange(-(-row // step) * step, row + n, step)
+
+
+def _binary_offsets(fname, header, step):
+    order = ply.byte_orders[header.format]
+    if os.path.getsize(fname) > header.size:
+        data = np.memmap(fname, dtype=np.uint8, mode='r', offset=header.size)
+    else:
+        data = np.zeros(0, dtype=np.uint8)
+    entries = []
+    pos = 0
+    for name, count, props in header.elements:
+        entry = {'name': name, 'count': count, 'properties': [list(p) for p in props],
+                 'offset': header.size + pos, 'row_size': None, 'checkpoints': None}
+        dtype = ply.element_dtype(props, order)
+        if dtype is not None:
+            entry['row_size'] = dtype.itemsize
+            pos += count * dtype.itemsize
+        elif props[-1][1] == 'list' and all(p[1] != 'list' for p in props[:-1]):
+            pos, entry['row_size'], checkpoints = _list_offsets(data, pos, count, props, order, step)
+        else:
+            pos, checkpoints = _walk_offsets(data, pos, count, props, order, step)
+        if entry['row_size'] is None:
+            entry['checkpoints'] = [header.size + c for c in checkpoints]
+        if pos > len(data):
+            raise RuntimeError('PLY: file is truncated')
+        entry['end'] = header.size + pos
+        entries.append(entry)
+    return entries
+
+
+def _list_offsets(data, pos, count, props, order, step):
+    # runs of rows with one list length, reading only the length fields;
+    # returns (end, row size if all rows have one, checkpoints)
+    name, _, itype, etype = props[-1]
+    head = ply.element_dtype(props[:-1], order).itemsize
+    countType = np.dtype(order + ply.ply_dtypes[itype])
+    itemSize = np.dtype(ply.ply_dtypes[etype]).itemsize
+    checkpoints = []
+    sizes = set()
+    row = 0
+    while row < count:
+        if pos + head + countType.itemsize > len(data):
+            raise RuntimeError('PLY: file is truncated')
+        k = int(np.frombuffer(data, countType, 1, pos + head)[0])
+        rowSize = head + countType.itemsize + k * itemSize
+        n = min(count - row, (len(data) - pos) // rowSize, CHUNK_ROWS)
+        if n <= 0:
+            raise RuntimeError('PLY: file is truncated')
+        counts = np.ndarray((n,), countType, buffer=data, offset=pos + head, strides=(rowSize,))
+        other = np.flatnonzero(counts != k)
+        if len(other):
+            n = int(other[0])
+        checkpoints.extend((pos + (_checkpoint_rows(row, n, step) - row) * rowSize).tolist())
+        sizes.add(rowSize)
+        pos += n * rowSize
+        row += n
+    if len(sizes) == 1:
+        return pos, sizes.pop(), None
+    return pos, None, checkpoints
+
+
+def _walk_offsets(data, pos, count, props, order, step):
+    checkpoints = []
+    for row in range(count):
+        if row % step == 0:
+            checkpoints.append(pos)
+        for p in props:
+            if p[1] == 'list':
+                countType = np.dtype(order + ply.ply_dtypes[p[2]])
+                if pos + countType.itemsize > len(data):
+                    raise RuntimeError('PLY: file is truncated')
+                n = int(np.frombuffer(data, countType, 1, pos)[0])
+                pos += countType.itemsize + n * np.dtype(ply.ply_dtypes[p[3]]).itemsize
+            else:
+                pos += np.dtype(ply.ply_dtypes[p[1]]).itemsize
+    return pos, checkpoints
+
+
+def _ascii_offsets(fname, header, step):
+    # one row per line: the starts of the lines of element boundaries and
+    # checkpoints, found by scanning for newlines
+    entries = []
+    wanted = []
+    line = 0
+    for name, count, props in header.elements:
+        entries.append({'name': name, 'count': count, 'properties': [list(p) for p in props],
+                        'row_size': None, 'first_line': line})
+        wanted.append(line + _checkpoint_rows(0, count, step))
+        line += count
+    total = line
+    wanted = np.unique(np.concatenate(wanted + [[total]]))
+
+    with open(fname, 'rb') as f:
+        f.seek(header.size)
+        pos = header.size
+        line = 0
+        # line 0 starts right after the header
+        starts = {0: pos}
+        while line < total:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+            # the line after the i-th newline of this chunk
+            lines = line + 1 + np.arange(len(newlines))
+            hit = np.isin(lines, wanted)
+            starts.update(zip(lines[hit].tolist(), (pos + newlines[hit] + 1).tolist()))
+            line += len(newlines)
+            pos += len(chunk)
+        if line < total:
+            raise RuntimeError('PLY: file is truncated')
+    if total not in starts:
+        starts[total] = pos
+
+    for entry in entries:
+        first = entry.pop('first_line')
+        rows = _checkpoint_rows(0, entry['count'], step)
+        entry['offset'] = starts[first]
+        entry['end'] = starts[first + entry['count']]
+        entry['checkpoints'] = [starts[first + r] for r in rows.tolist()]
+    return entries
+
+
+def _binary_bbox(fname, fmt, entries):
+    # ((min x, min y, min z), (max x, max y, max z)) of the vertex element,
+    # reading its x, y and z fields a chunk of rows at a time
+    try:
+        entry = element_entry({'elements': entries}, 'vertex')
+    except ValueError:
+        return None
+    props = [tuple(p) for p in entry['properties']]
+    dtype = ply.element_dtype(props, ply.byte_orders[fmt])
+    if dtype is None or not entry['count'] or not all(c in dtype.names for c in 'xyz'):
+        return None
+    rows = np.memmap(fname, dtype=dtype, mode='r', offset=entry['offset'], shape=(entry['count'],))
+    lo = [np.inf] * 3
+    hi = [-np.inf] * 3
+    for a in range(0, entry['count'], CHUNK_ROWS):
+        chunk = rows[a:a + CHUNK_ROWS]
+        for i, c in enumerate('xyz'):
+            column = chunk[c]
+            lo[i] = min(lo[i], float(column.min()))
+            hi[i] = max(hi[i], float(column.max()))
+    return [lo, hi]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the layout of ply files without reading their bodies')
+    parser.add_argument('files', nargs='+', help='ply files')
+    parser.add_argument('--json', action='store_true', help='Print the whole index as JSON')
+    parser.add_argument('--no-save', action='store_true', help='Do not write .plyidx files')
+    args = parser.parse_args()
+
+    for fname in args.files:
+        try:
+            index = inspect(fname, save=not args.no_save)
+        except (RuntimeError, IOError, OSError) as e:
+            print('{}: {}'.format(fname, e), file=sys.stderr)
+            continue
+        if args.json:
+            print(json.dumps(dict(index, file=fname)))
+            continue
+        print('{} ({})'.format(fname, index['format']))
+        for entry in index['elements']:
+            props = ', '.join(' '.join(p[1:] + p[:1]) for p in entry['properties'])
+            print('  {} {} at {}-{}: {}'.format(entry['name'], entry['count'],
+                                                 entry['offset'], entry['end'], props))
+        if index['bbox']:
+            print('  bbox {} {}'.format(*index['bbox']))
@@ -0,0 +1,116 @@
+import os
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+import filetypes
+from Mesh import Mesh
+
+# Loads many model files on a process pool. Every worker parses a file,
+# computes its normals (and edge tables) and copies the arrays into one
+# shared memory block; the parent maps the block, so no mesh data is
+# pickled or copied between processes.
+
+ALIGN = 64
+
+class SharedMesh(object):
+    """The Mesh of path with its arrays in the shared memory block name.
+    release() unlinks the block; its memory stays mapped until the mesh
+    and every view of its arrays are gone."""
+
+    def __init__(self, path, name, layout):
+        self.path = path
+        self.block = shared_memory.SharedMemory(name=name)
+        arrays = dict((key, np.ndarray(shape, dtype, buffer=self.block.buf, offset=offset))
+                      for key, dtype, shape, offset in layout)
+        self.mesh = Mesh.fromArrayDict(arrays)
+
+    def release(self):
+        if self.block is None:
+            return
+        self.mesh = None
+        self.block.unlink()
+        # close() would unmap the block under arrays still held elsewhere,
+        # numpy views do not pin it; the memoryview they refer to keeps the
+        # mapping, so only the file descriptor is closed here
+        self.block._buf = self.block._mmap = None
+        self.block.close()
+        self.block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _load(job):
+    path, edges, cache = job
+    try:
+        parse = filetypes.loader(path)
+        if cache is not None:
+            mesh = cache.load(path, parse)
+        else:
+            mesh = parse(path)
+        if not mesh.isArrayBacked():
+            raise RuntimeError('{} does not load into arrays'.format(path))
+        if mesh.faceNormals is None:
+            mesh.calculateNormals()
+        if edges and mesh.edgeArray is None:
+            mesh.calculateEdges()
+
+        layout = []
+        size = 0
+        for key, a in sorted(mesh.arrays().items()):
+            layout.append((key, a.dtype.str, a.shape, size))
+            size += (a.nbytes + ALIGN - 1) // ALIGN * ALIGN
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for key, dtype, shape, offset in layout:
+            np.ndarray(shape, dtype, buffer=block.buf, offset=offset)[...] = getattr(mesh, key)
+        mesh = None
+        name = block.name
+        # the parent owns the block from here on; without unregistering it the
+        # resource tracker of this process unlinks it when the pool exits
+        resource_tracker.unregister(block._name, 'shared_memory')
+        block.close()
+        return path, name, layout, None
+    except Exception as e:
+        return path, None, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def load_shared(paths, jobs=None, edges=True, cache=None):
+    """SharedMesh objects of paths, in order, loaded by jobs processes; the
+    edge tables are built in the workers too unless edges is False. With a
+    meshcache.MeshCache as cache, workers load through it. Raises
+    RuntimeError naming the files that fail, after freeing the rest."""
+    jobs = jobs or multiprocessing.cpu_count()
+    # largest files first keeps the workers busy until the end
+    order = sorted(range(len(paths)), key=lambda i: -os.path.getsize(paths[i]))
+    work = [(paths[i], edges, cache) for i in order]
+    if jobs > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(paths)))
+        try:
+            results = pool.map(_load, work, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_load(job) for job in work]
+
+    meshes = [None] * len(paths)
+    errors = []
+    for i, (path, name, layout, error) in zip(order, results):
+        if error:
+            errors.append(error)
+            continue
+        # the block has to outlive the worker that made it
+        try:
+            meshes[i] = SharedMesh(path, name, layout)
+        except FileNotFoundError:
+            errors.append('{}: shared memory block {} is gone'.format(path, name))
+    if errors:
+        for m in meshes:
+            if m is not None:
+                m.release()
+        raise RuntimeError('could not load {}'.format('; '.join(errors)))
+    return meshes